@@ -1,7 +1,10 @@
 import feedparser
+import hashlib
+import heapq
 import urllib.parse
 import requests
 import os
+import queue
 import re
 import time
 import json
@@ -9,10 +12,30 @@ import urllib3
 import logging
 import random
 import signal
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass
 from datetime import datetime
-from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse
+from xml.etree import ElementTree
 from typing import Dict, Optional, Set, List, Tuple
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # 可选：Bark 推送使用 HTTP/2，需要 pip install httpx[http2]
+except ImportError:
+    httpx = None
+
+try:
+    from re._casefix import _EXTRA_CASES as _RE_EXTRA_CASES  # Python 3.11+
+except ImportError:
+    try:
+        from sre_compile import _ignorecase_fixes as _RE_EXTRA_CASES  # Python 3.7 ~ 3.10
+    except ImportError:
+        _RE_EXTRA_CASES = {}
 
 # 禁用不安全请求的警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -28,9 +51,35 @@ CONFIG = {
     "use_proxy": "yes",  # 是否使用代理 "yes" 或 "no"
     "proxy_interval": 120,  # 代理模式检查间隔(秒)
     "local_interval": 300,  # 本地模式检查间隔(秒)
+    "min_interval": 60,  # 单个源最短检查间隔(秒)，各源间隔按更新频率自适应
+    "max_interval": 1800,  # 单个源最长检查间隔(秒)
     "max_retries": 1,  # 最大重试次数
+    "hedge_requests": False,  # 请求耗时超过该代理在该域名上的 p90 时，换一个空闲代理再发一次，取先返回的结果
+    "hedge_min_samples": 5,  # 代理在该域名上至少有这么多次成功记录后才会对冲
+    "max_workers": 8,  # 同时检查的源数量，1 为逐个检查
+    "per_domain_limit": 2,  # 同一域名同时进行的检查数量上限
     "proxy_file": "./local_proxies.txt",
-    "bark_url": "https://yourbarkurl.com/barktoken"
+    "validator_file": "./http_validators.json",  # 各源的 ETag/Last-Modified，用于条件请求
+    "cache_capacity": 5000,  # 每个源记住的最近条目数，远大于源一次返回的条目数即可
+    "cache_bloom_bits": 0,  # 大于 0 时被挤出的条目记入该位数的布隆过滤器（有极小概率误判为已处理），0 为关闭
+    "cache_bloom_hashes": 7,  # 布隆过滤器的哈希函数个数
+    "proxy_state_file": "./proxy_state.json",  # 代理在各域名上的冷却与健康状态，重启后恢复
+    "proxy_state_interval": 300,  # 代理状态保存间隔(秒)，退出时也会保存
+    "max_feed_bytes": 5 * 1024 * 1024,  # 单个源解压后读取的最大字节数
+    "fast_parser": True,  # True: 只提取标题/链接/ID 的快速解析；False: 使用 feedparser 完整解析
+    "early_stop_seen": 3,  # 连续遇到这么多已处理条目后停止读取，0 为关闭
+    "early_stop_recheck": 10,  # 每提前停止这么多次后完整读取一次，重新确认源的排序
+    "bark_url": "https://yourbarkurl.com/barktoken",
+    "pool_connections": 10,  # 每个会话缓存连接池的主机数
+    "pool_maxsize": 10,  # 每个主机保持的最大连接数
+    "bark_http2": False,  # Bark 推送是否使用 HTTP/2（需要安装 httpx[http2]）
+    "push_workers": 4,  # 后台推送线程数，0 为在检查线程中直接发送
+    "push_queue_size": 1000,  # 待推送队列长度上限，队列满时检查线程等待
+    "push_retries": 3,  # 网络错误、429、5xx 时的重试次数
+    "push_backoff": 2,  # 重试退避的基础秒数，第 n 次重试等待约 push_backoff * 2^n 秒
+    "push_batch": 1,  # 大于 1 时同一分组最多这么多条合并为一次推送
+    "push_batch_wait": 2,  # 合并推送时等待更多条目的最长秒数
+    "push_drain_timeout": 30  # 退出时等待队列发送完毕的最长秒数
 }
 
 RSS_SOURCES = [
@@ -51,32 +100,201 @@ RSS_SOURCES = [
 # 全局变量用于控制程序退出
 running = True
 
+# 源内容未变化 (HTTP 304) 时 fetch_rss 的返回值
+NOT_MODIFIED = object()
+
+
+def source_key(source: dict) -> str:
+    """源的标识：每个源有自己的缓存文件，同一 URL 配置多次时也互不相同"""
+    return source['cache_file']
+
 
 @dataclass
 class ProxyState:
     """代理状态记录"""
     last_used: Dict[str, datetime] = None  # 每个域名的最后使用时间
-    fail_count: Dict[str, int] = None  # 每个域名的失败次数
+    fail_count: Dict[str, int] = None  # 每个域名的连续失败次数
     success_count: Dict[str, int] = None  # 每个域名的成功次数
+    success_rate: Dict[str, float] = None  # 每个域名成功率的指数滑动平均
+    latency: Dict[str, float] = None  # 每个域名成功请求耗时(秒)的指数滑动平均
+    samples: Dict[str, deque] = None  # 每个域名最近成功请求的耗时，用于计算分位数
 
     def __init__(self):
         self.last_used = {}
         self.fail_count = {}
         self.success_count = {}
+        self.success_rate = {}
+        self.latency = {}
+        self.samples = {}
+
+
+class DomainQueue:
+    """
+    单个域名的代理队列：就绪堆按健康分从高到低，冷却堆按冷却结束时间从早到晚
+    正在使用的代理不在任何堆中；每个代理只有最新压入的堆项有效，其余堆项在弹出时跳过
+    """
+
+    def __init__(self):
+        self.tokens: Dict[str, int] = {}  # 代理 -> 当前有效堆项的编号
+        self.counter = 0
+        self.ready: List[Tuple[float, int, str]] = []
+        self.cooling: List[Tuple[float, int, str]] = []
+
+    def _token(self, proxy: str) -> int:
+        self.counter += 1
+        self.tokens[proxy] = self.counter
+        return self.counter
+
+    def _valid(self, entry: Tuple[float, int, str]) -> bool:
+        return self.tokens.get(entry[2]) == entry[1]
+
+    def push_ready(self, proxy: str, score: float) -> None:
+        heapq.heappush(self.ready, (-score, self._token(proxy), proxy))
+
+    def push_cooling(self, proxy: str, ready_at: float) -> None:
+        heapq.heappush(self.cooling, (ready_at, self._token(proxy), proxy))
+
+    def discard(self, proxy: str) -> None:
+        self.tokens.pop(proxy, None)
+
+    def promote(self, now: float):
+        """弹出所有冷却结束的代理，由调用方按最新健康分放回就绪堆"""
+        while self.cooling and self.cooling[0][0] <= now:
+            entry = heapq.heappop(self.cooling)
+            if self._valid(entry):
+                yield entry[2]
+
+    def pop(self, ready_only: bool = False) -> Optional[str]:
+        """取出健康分最高的就绪代理；没有就绪代理时取最早结束冷却的代理；全部在使用中时返回 None"""
+        for heap in (self.ready,) if ready_only else (self.ready, self.cooling):
+            while heap:
+                entry = heapq.heappop(heap)
+                if self._valid(entry):
+                    # 使用中：保留编号但使其不再对应任何堆项
+                    self.tokens[entry[2]] = 0
+                    return entry[2]
+        return None
+
+    def compact(self) -> None:
+        """丢弃无效堆项"""
+        self.ready = [entry for entry in self.ready if self._valid(entry)]
+        self.cooling = [entry for entry in self.cooling if self._valid(entry)]
+        heapq.heapify(self.ready)
+        heapq.heapify(self.cooling)
 
 
 class ProxyManager:
-    def __init__(self, cooldown: int = 300):
+    """
+    代理选择与状态记录，可在多个线程中同时使用
+    每个域名一个 DomainQueue，选择代理为 O(log n)；代理列表变化时才按集合对账
+    健康分 = 成功率 EWMA / (1 + 延迟 EWMA)，就绪的代理中优先选择健康分高的
+    state_file 不为空时从中恢复上次保存的状态，冷却未结束的代理重启后继续冷却
+    """
+
+    def __init__(self, cooldown: int = 300, alpha: float = 0.3, window: int = 20,
+                 state_file: Optional[str] = None):
         self.proxy_states: Dict[str, ProxyState] = {}
         self.cooldown = cooldown
-        self.current_indexes: Dict[str, int] = {}
+        self.alpha = alpha  # EWMA 平滑系数
+        self.window = window  # 每个代理每个域名保留的耗时样本数
+        self.proxies: Set[str] = set()
+        self.synced_list: Optional[List[str]] = None  # 上次对账时的代理列表对象
+        self.queues: Dict[str, DomainQueue] = {}
+        self.lock = threading.RLock()
+        self.state_file = state_file
+        self.dirty = False
+        if state_file:
+            self.load()
+
+    def load(self) -> None:
+        """
+        加载状态快照：{"domains": [域名...], "proxies": {代理: [[域名序号, 最后使用时间戳, 连续失败, 成功次数, 成功率, 延迟], ...]}}
+        域名只存一次，每条记录是一个定长数组，json.load 即可还原，不需要逐条解析
+        """
+        try:
+            if not os.path.exists(self.state_file):
+                return
+            with open(self.state_file, "r") as f:
+                snapshot = json.load(f)
+            domains = snapshot["domains"]
+            for proxy, rows in snapshot["proxies"].items():
+                state = self._get_or_create_state(proxy)
+                for index, last_used, fail, success, rate, latency in rows:
+                    domain = domains[index]
+                    state.last_used[domain] = datetime.fromtimestamp(last_used)
+                    state.fail_count[domain] = fail
+                    state.success_count[domain] = success
+                    state.success_rate[domain] = rate
+                    if latency is not None:
+                        state.latency[domain] = latency
+            logging.info(f"已恢复 {len(self.proxy_states)} 个代理的状态")
+        except Exception as e:
+            logging.error(f"加载代理状态失败: {e}")
+
+    def save(self) -> None:
+        """状态有变化时写入快照，先写临时文件再替换，退出时被中断也不会留下半个文件"""
+        if not self.state_file:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            domains: Dict[str, int] = {}
+            proxies = {}
+            for proxy, state in self.proxy_states.items():
+                proxies[proxy] = [
+                    [
+                        domains.setdefault(domain, len(domains)),
+                        round(last_used.timestamp(), 1),
+                        state.fail_count.get(domain, 0),
+                        state.success_count.get(domain, 0),
+                        round(state.success_rate.get(domain, 1.0), 4),
+                        round(state.latency[domain], 3) if domain in state.latency else None,
+                    ]
+                    for domain, last_used in state.last_used.items()
+                ]
+            self.dirty = False
+        try:
+            temp_file = self.state_file + ".tmp"
+            with open(temp_file, "w") as f:
+                json.dump({"domains": list(domains), "proxies": proxies}, f, separators=(",", ":"))
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            self.dirty = True
+            logging.error(f"保存代理状态失败: {e}")
+
+    def _enqueue(self, queue: DomainQueue, proxy: str, domain: str, now: float) -> None:
+        """按记录的最后使用时间放入冷却堆或就绪堆，用于新建队列和新加入的代理"""
+        state = self.proxy_states.get(proxy)
+        last_used = state.last_used.get(domain) if state else None
+        if last_used is not None:
+            penalty = 2 if state.fail_count.get(domain, 0) >= 3 else 1
+            ready_at = last_used.timestamp() + self.cooldown * penalty
+            if ready_at > now:
+                queue.push_cooling(proxy, ready_at)
+                return
+            if penalty == 2:
+                state.fail_count[domain] = 0
+        queue.push_ready(proxy, self.score(proxy, domain))
 
     def clean_invalid_proxies(self, current_proxies: List[str]) -> None:
-        """清理已不存在的代理状态"""
-        invalid_proxies = [proxy for proxy in list(self.proxy_states.keys())
-                           if proxy not in current_proxies]
-        for proxy in invalid_proxies:
+        """与当前代理列表对账：清理已不存在的代理，新代理加入各域名的队列"""
+        current = set(current_proxies)
+        removed = self.proxies - current
+        added = current - self.proxies
+        # 包括从快照恢复、但已不在代理列表中的代理
+        for proxy in [proxy for proxy in self.proxy_states if proxy not in current]:
             del self.proxy_states[proxy]
+            self.dirty = True
+        now = time.time()
+        for domain, queue in self.queues.items():
+            for proxy in removed:
+                queue.discard(proxy)
+            for proxy in added:
+                self._enqueue(queue, proxy, domain, now)
+            if len(queue.ready) + len(queue.cooling) > 2 * len(current) + 16:
+                queue.compact()
+        self.proxies = current
+        self.synced_list = current_proxies
 
     def get_domain(self, url: str) -> str:
         return urlparse(url).netloc
@@ -85,275 +303,1223 @@ class ProxyManager:
         """获取或创建代理状态"""
         return self.proxy_states.setdefault(proxy, ProxyState())
 
-    def can_use_proxy(self, proxy: str, domain: str) -> bool:
+    def score(self, proxy: str, domain: str) -> float:
         state = self._get_or_create_state(proxy)
-
-        if domain in state.last_used:
-            time_since_last_use = (datetime.now() - state.last_used[domain]).total_seconds()
-            if time_since_last_use < self.cooldown:
-                return False
-
-            if state.fail_count.get(domain, 0) >= 3:
-                if time_since_last_use >= self.cooldown * 2:
-                    state.fail_count[domain] = 0
-                    return True
-                return False
-
-        return True
-
-    def select_proxy(self, url: str, proxies: List[str]) -> Optional[str]:
+        return state.success_rate.get(domain, 1.0) / (1 + state.latency.get(domain, 0.0))
+
+    def latency_quantile(self, url: str, proxy: str, q: float = 0.9) -> Optional[float]:
+        """代理在该域名上最近成功请求耗时的分位数，样本不足 hedge_min_samples 时返回 None"""
+        with self.lock:
+            samples = self._get_or_create_state(proxy).samples.get(self.get_domain(url))
+            if not samples or len(samples) < CONFIG["hedge_min_samples"]:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def select_proxy(self, url: str, proxies: List[str], ready_only: bool = False) -> Optional[str]:
+        """
+        选择代理并占用到 update_proxy_result 或 release_proxy 为止，所有代理都正在访问该域名时返回 None
+        ready_only 为 True 时不使用仍在冷却中的代理
+        """
         if not proxies:
             return None
 
-        # 清理不存在的代理状态
-        self.clean_invalid_proxies(proxies)
-
-        domain = self.get_domain(url)
-        current_index = self.current_indexes.get(domain, -1)
-        available_proxies = [p for p in proxies if self.can_use_proxy(p, domain)]
-
-        if available_proxies:
-            current_index = (current_index + 1) % len(proxies)
-            self.current_indexes[domain] = current_index
-            return available_proxies[current_index % len(available_proxies)]
+        with self.lock:
+            # load_proxies 在文件未修改时返回同一个列表对象，此时无需对账
+            if proxies is not self.synced_list:
+                self.clean_invalid_proxies(proxies)
+
+            domain = self.get_domain(url)
+            queue = self.queues.get(domain)
+            if queue is None:
+                queue = self.queues[domain] = DomainQueue()
+                now = time.time()
+                for proxy in self.proxies:
+                    self._enqueue(queue, proxy, domain, now)
+
+            for proxy in list(queue.promote(time.time())):
+                state = self._get_or_create_state(proxy)
+                # 连续失败的代理经过加倍的冷却后重新计数
+                if state.fail_count.get(domain, 0) >= 3:
+                    state.fail_count[domain] = 0
+                queue.push_ready(proxy, self.score(proxy, domain))
 
-        return min(proxies,
-                   key=lambda p: self._get_or_create_state(p).last_used.get(domain, datetime.min))
+            return queue.pop(ready_only)
 
-    def update_proxy_result(self, url: str, proxy: str, success: bool) -> None:
+    def release_proxy(self, url: str, proxy: str, elapsed: Optional[float] = None) -> None:
+        """
+        归还被取消的请求占用的代理，不计入成功或失败，也不进入冷却
+        已耗费的时间是实际耗时的下限，计入延迟 EWMA，使慢代理之后排在后面
+        """
         domain = self.get_domain(url)
-        state = self._get_or_create_state(proxy)
-        state.last_used[domain] = datetime.now()
+        with self.lock:
+            state = self._get_or_create_state(proxy)
+            if elapsed is not None:
+                previous = state.latency.get(domain, elapsed)
+                state.latency[domain] = self.alpha * elapsed + (1 - self.alpha) * max(previous, elapsed)
+            queue = self.queues.get(domain)
+            if queue is not None and proxy in self.proxies:
+                queue.push_ready(proxy, self.score(proxy, domain))
+
+    def update_proxy_result(self, url: str, proxy: str, success: bool, latency: Optional[float] = None) -> None:
+        domain = self.get_domain(url)
+        with self.lock:
+            state = self._get_or_create_state(proxy)
+            state.last_used[domain] = datetime.now()
+            self.dirty = True
 
-        if success:
-            state.success_count[domain] = state.success_count.get(domain, 0) + 1
-            state.fail_count[domain] = 0
-        else:
-            state.fail_count[domain] = state.fail_count.get(domain, 0) + 1
+            rate = state.success_rate.get(domain, 1.0)
+            state.success_rate[domain] = self.alpha * (1.0 if success else 0.0) + (1 - self.alpha) * rate
+            if success:
+                state.success_count[domain] = state.success_count.get(domain, 0) + 1
+                state.fail_count[domain] = 0
+                if latency is not None:
+                    previous = state.latency.get(domain, latency)
+                    state.latency[domain] = self.alpha * latency + (1 - self.alpha) * previous
+                    state.samples.setdefault(domain, deque(maxlen=self.window)).append(latency)
+            else:
+                state.fail_count[domain] = state.fail_count.get(domain, 0) + 1
+
+            # 放回冷却堆，连续失败 3 次的代理冷却时间加倍
+            queue = self.queues.get(domain)
+            if queue is not None and proxy in self.proxies:
+                penalty = 2 if state.fail_count[domain] >= 3 else 1
+                queue.push_cooling(proxy, time.time() + self.cooldown * penalty)
 
     def get_proxy_stats(self) -> str:
         """获取代理状态统计"""
         stats = ["代理状态统计:"]
-        for proxy, state in self.proxy_states.items():
-            stats.append(f"代理: {proxy}")
-            for domain in state.last_used.keys():
-                time_ago = (datetime.now() - state.last_used[domain]).total_seconds()
-                stats.append(f"最后使用: {time_ago:.0f}秒前   访问域名为{domain}")
+        with self.lock:
+            for proxy, state in self.proxy_states.items():
+                stats.append(f"代理: {proxy}")
+                for domain in state.last_used.keys():
+                    time_ago = (datetime.now() - state.last_used[domain]).total_seconds()
+                    stats.append(
+                        f"最后使用: {time_ago:.0f}秒前   访问域名为{domain}   健康分: {self.score(proxy, domain):.2f}"
+                    )
 
         return "\n".join(stats)
 
 
+class ValidatorStore:
+    """条件请求校验信息 (ETag/Last-Modified) 的持久化存储"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.validators: Dict[str, Dict[str, Optional[str]]] = {}
+        self.dirty = False
+        self.not_modified = 0  # 命中 304 的次数，即省下的解析次数
+        self.bytes_saved = 0  # 省下的流量字节数（按上次完整响应估算）
+        self.lock = threading.Lock()
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    self.validators = json.load(f)
+        except Exception as e:
+            logging.error(f"加载校验信息失败: {e}")
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        cached = self.validators.get(url, {})
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    def record_not_modified(self, url: str) -> None:
+        with self.lock:
+            self.not_modified += 1
+            self.bytes_saved += self.validators.get(url, {}).get("length", 0)
+
+    def update(self, url: str, response: requests.Response, length: int) -> None:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with self.lock:
+            if not etag and not last_modified:
+                if self.validators.pop(url, None) is not None:
+                    self.dirty = True
+                return
+
+            record = {"etag": etag, "last_modified": last_modified, "length": length}
+            if self.validators.get(url) != record:
+                self.validators[url] = record
+                self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                with open(self.path, "w") as f:
+                    json.dump(self.validators, f)
+                self.dirty = False
+            except Exception as e:
+                logging.error(f"保存校验信息失败: {e}")
+
+    def get_stats(self) -> str:
+        return f"条件请求: 跳过解析 {self.not_modified} 次, 节省流量 {self.bytes_saved} 字节"
+
+
+validator_store = ValidatorStore(CONFIG["validator_file"])
+
+
+# telegram_rss_bot.py 中有一份对应的 parse_retry_after、parse_max_age 与 FeedScheduler；本脚本按单个文件部署，不能引用该模块，修改时两处需同步
+def parse_retry_after(value: Optional[str]) -> float:
+    """解析 Retry-After（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return 0
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_max_age(value: Optional[str]) -> int:
+    """解析 Cache-Control 中的 max-age(秒)"""
+    match = re.search(r"max-age\s*=\s*(\d+)", value or "")
+    return int(match.group(1)) if match else 0
+
+
+class FeedScheduler:
+    """
+    按源调度检查：每个源有自己的下次检查时间，保存在最小堆中
+    间隔按观测到的新条目速率自适应调整，遵守源的 <ttl>、Cache-Control 与 Retry-After，
+    并加入随机抖动，避免所有源在同一时刻集中检查
+    note_response/note_feed 在检查线程中调用，其余在主循环中调用，所有方法都在锁内执行
+    """
+
+    def __init__(self, base_interval: float, min_interval: float, max_interval: float, jitter: float = 0.1):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.jitter = jitter
+        self.heap: List[Tuple[float, str]] = []  # (到期时间, 源)，过期的堆项按 next_due 判断
+        self.next_due: Dict[str, float] = {}  # 已取出待检查的源不在其中
+        self.intervals: Dict[str, float] = {}
+        self.post_rates: Dict[str, float] = {}  # 新条目速率的指数滑动平均(条/秒)
+        self.last_fetch: Dict[str, float] = {}
+        self.hints: Dict[str, float] = {}  # 服务器或源要求的最短等待时间(秒)
+        self.retry_after: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def _push(self, url: str, due: float) -> None:
+        self.next_due[url] = due
+        heapq.heappush(self.heap, (due, url))
+
+    def sync(self, urls) -> None:
+        """新源（以及取出后未重新调度的源）立即到期，已移除的源丢弃"""
+        with self.lock:
+            now = time.time()
+            for url in urls:
+                if url not in self.next_due:
+                    self._push(url, now)
+            for url in list(self.next_due):
+                if url not in urls:
+                    for state in (self.next_due, self.intervals, self.post_rates,
+                                  self.last_fetch, self.hints, self.retry_after):
+                        state.pop(url, None)
+
+    def pop_due(self, now: Optional[float] = None) -> List[str]:
+        """取出所有已到期的源"""
+        with self.lock:
+            now = time.time() if now is None else now
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due_at, url = heapq.heappop(self.heap)
+                if self.next_due.get(url) != due_at:
+                    continue
+                del self.next_due[url]
+                due.append(url)
+            return due
+
+    def note_response(self, url: str, response: requests.Response) -> None:
+        """记录响应头中的调度提示"""
+        with self.lock:
+            self.hints[url] = parse_max_age(response.headers.get("Cache-Control"))
+            if response.status_code in (429, 503):
+                self.retry_after[url] = parse_retry_after(response.headers.get("Retry-After"))
+
+    def note_feed(self, url: str, feed: feedparser.FeedParserDict) -> None:
+        """记录源自身声明的 <ttl>(分钟)"""
+        with self.lock:
+            try:
+                ttl = int(feed.feed.get("ttl", 0)) * 60
+            except (TypeError, ValueError):
+                ttl = 0
+            self.hints[url] = max(self.hints.get(url, 0), ttl)
+
+    def reschedule(self, url: str, new_entries: Optional[int]) -> None:
+        """安排下次检查，new_entries 为 None 表示检查失败"""
+        with self.lock:
+            now = time.time()
+            interval = self.intervals.get(url, self.base_interval)
+            last_fetch = self.last_fetch.get(url)
+
+            if new_entries is None:
+                # 失败时指数退避
+                interval = min(self.max_interval, interval * 2)
+            else:
+                self.last_fetch[url] = now
+                # 首次检查的条目都是新的，不代表发帖速率
+                if last_fetch is not None:
+                    observed = new_entries / max(now - last_fetch, 1)
+                    rate = 0.3 * observed + 0.7 * self.post_rates.get(url, observed)
+                    self.post_rates[url] = rate
+                    # 目标是平均每次检查约有一条新条目
+                    interval = 1 / rate if rate > 0 else interval * 1.5
+                    interval = min(self.max_interval, max(self.min_interval, interval))
+            self.intervals[url] = interval
+
+            delay = max(interval, min(self.hints.pop(url, 0), self.max_interval))
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            # Retry-After 是服务器的明确要求，不受最长间隔限制
+            delay = max(delay, self.retry_after.pop(url, 0))
+            self._push(url, now + delay)
+
+    def next_wakeup(self) -> Optional[float]:
+        """下一个源的到期时间"""
+        with self.lock:
+            while self.heap and self.next_due.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+
+feed_scheduler = FeedScheduler(
+    CONFIG["proxy_interval"] if CONFIG["use_proxy"].lower() == "yes" else CONFIG["local_interval"],
+    CONFIG["min_interval"],
+    CONFIG["max_interval"]
+)
+
+
+class SessionPool:
+    """
+    长连接会话池：每个代理一个会话（直连共用一个），Bark 推送单独一个，在各轮检查之间复用，
+    避免每次请求都重新建立 TCP/TLS 连接和代理 CONNECT 隧道
+    """
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, push_http2: bool = False):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.push_http2 = push_http2
+        self.sessions: Dict[Optional[str], requests.Session] = {}
+        self.push_client = None
+        self.lock = threading.Lock()
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, proxy: Optional[str] = None) -> requests.Session:
+        """获取抓取用的会话，proxy 为 None 时为直连"""
+        with self.lock:
+            session = self.sessions.get(proxy)
+            if session is None:
+                session = self._new_session()
+                self.sessions[proxy] = session
+            return session
+
+    def get_push(self):
+        """获取 Bark 推送用的客户端，启用 HTTP/2 且已安装 httpx 时为 httpx.Client"""
+        with self.lock:
+            return self._get_push()
+
+    def _get_push(self):
+        if self.push_client is None:
+            if self.push_http2 and httpx is not None:
+                try:
+                    limits = httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize)
+                    self.push_client = httpx.Client(http2=True, limits=limits)
+                except ImportError:
+                    logging.warning("未安装 h2，Bark 推送使用 HTTP/1.1")
+            elif self.push_http2:
+                logging.warning("未安装 httpx，Bark 推送使用 HTTP/1.1")
+            if self.push_client is None:
+                self.push_client = self._new_session()
+        return self.push_client
+
+    def prune(self, proxies: list) -> None:
+        """关闭已不在代理列表中的代理会话"""
+        active = {normalize_proxy(proxy) for proxy in proxies}
+        with self.lock:
+            for proxy in list(self.sessions):
+                if proxy is not None and proxy not in active:
+                    self.sessions.pop(proxy).close()
+
+    def close(self) -> None:
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+            if self.push_client is not None:
+                self.push_client.close()
+                self.push_client = None
+
+
+def normalize_proxy(proxy: Optional[str]) -> Optional[str]:
+    """添加 http:// 前缀"""
+    if proxy and not proxy.startswith('http'):
+        return f'http://{proxy}'
+    return proxy
+
+
+session_pool = SessionPool(CONFIG["pool_connections"], CONFIG["pool_maxsize"], CONFIG["bark_http2"])
+
+
+# 由 main 创建，signal_handler 退出时保存其状态
+proxy_manager: Optional[ProxyManager] = None
+
+
 def signal_handler(signum, frame):
     """信号处理函数"""
     global running
     logging.info('接收到退出信号，准备安全退出...')
     running = False
+    # 主循环可能正在等待下次检查，先保存代理状态，避免被强制结束时丢失
+    if proxy_manager is not None:
+        proxy_manager.save()
+
+
+# 代理文件的修改时间与上次读取的结果
+_proxy_cache: Dict[str, object] = {"mtime": None, "proxies": []}
 
 
 def load_proxies() -> list:
-    """加载代理列表"""
+    """加载代理列表，文件未修改时返回上次读取的同一个列表对象"""
     try:
         if os.path.exists(CONFIG["proxy_file"]):
+            mtime = os.path.getmtime(CONFIG["proxy_file"])
+            if mtime == _proxy_cache["mtime"]:
+                return _proxy_cache["proxies"]
             with open(CONFIG["proxy_file"], "r") as f:
-                # 读取所有行并过滤空行
-                proxies = [line.strip() for line in f if line.strip()]
-                return proxies
+                # 读取所有行并过滤空行、去重
+                proxies = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+            _proxy_cache["mtime"] = mtime
+            _proxy_cache["proxies"] = proxies
+            return proxies
         return []
     except Exception as e:
         logging.error(f"加载代理列表失败: {e}")
         return []
 
 
-def match_keywords(text: str, pattern: str) -> bool:
-    """匹配关键词"""
-    try:
-        if pattern.startswith('+'):
-            terms = pattern.split('+')[1:]
-            include_terms = [t for t in terms if not t.startswith('-')]
-            exclude_terms = [t[1:] for t in terms if t.startswith('-')]
-
-            return (
-                    all(re.search(f".*{re.escape(term)}.*", text, re.I) for term in include_terms) and
-                    not any(re.search(f".*{re.escape(term)}.*", text, re.I) for term in exclude_terms)
-            )
-        else:
-            return bool(re.search(f".*{re.escape(pattern)}.*", text, re.I))
-    except Exception as e:
-        logging.error(f"正则匹配错误: {e}")
-        return False
+# 大小写归一表：İ 按 re.IGNORECASE 的单字符规则视为 i，再把 re 额外视为相同的字符（如 ı/i、ſ/s）统一
+_CASE_FOLD_BEFORE_LOWER = {0x130: "i"}
+_CASE_FOLD = {
+    char: min(char, *equivalents)
+    for char, equivalents in _RE_EXTRA_CASES.items()
+    if min(char, *equivalents) != char
+}
 
 
-def load_cache(cache_file: str) -> Set[str]:
-    """加载缓存"""
-    try:
-        if os.path.exists(cache_file):
-            with open(cache_file, "r") as f:
-                return set(json.load(f))
-        return set()
-    except Exception as e:
-        logging.error(f"加载缓存失败: {e}")
-        return set()
+# telegram_rss_bot.py 中有一份对应的大小写归一（那里的 fold_case 要求文本已 lower()）；本脚本按单个文件部署，不能引用该模块，修改时两处需同步
+def fold_case(text: str) -> str:
+    """大小写归一，归一后的子串匹配与 re.IGNORECASE 结果一致"""
+    return text.translate(_CASE_FOLD_BEFORE_LOWER).lower().translate(_CASE_FOLD)
+
+
+@lru_cache(maxsize=None)
+def parse_keyword_rule(pattern: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """把关键词规则解析为 (必须包含的词, 不能包含的词)，均已归一"""
+    if pattern.startswith('+'):
+        terms = pattern.split('+')[1:]
+        include_terms = tuple(fold_case(t) for t in terms if not t.startswith('-'))
+        exclude_terms = tuple(fold_case(t[1:]) for t in terms if t.startswith('-'))
+        return include_terms, exclude_terms
+    return (fold_case(pattern),), ()
+
+
+def match_keywords(text: str, patterns: List[str]) -> Optional[str]:
+    """匹配关键词，返回第一条命中的规则；标题只归一一次，各规则共享词的查找结果"""
+    folded = fold_case(text)
+    present: Dict[str, bool] = {}
+
+    def contains(term: str) -> bool:
+        found = present.get(term)
+        if found is None:
+            found = present[term] = term in folded
+        return found
+
+    for pattern in patterns:
+        include_terms, exclude_terms = parse_keyword_rule(pattern)
+        if all(contains(t) for t in include_terms) and not any(contains(t) for t in exclude_terms):
+            return pattern
+    return None
+
+
+class BloomFilter:
+    """定长布隆过滤器，k 个位置由一次 blake2b 摘要双重哈希得到"""
+
+    def __init__(self, bits: int, hashes: int, data: Optional[bytes] = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data and len(data) == (bits + 7) // 8 else bytearray((bits + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SeenStore:
+    """
+    单个源已处理条目的 GUID 缓存，常驻内存，容量固定
+    最近 capacity 个 GUID 保存在环形队列中并用集合索引；被挤出的 GUID 可选记入布隆过滤器
+    文件为追加写入的 JSON Lines（每行一个 GUID），每轮只追加新条目；行数超过容量两倍时按内存内容重写
+    旧版 JSON 列表格式的缓存是无序的，无法按新旧截断：首次加载时整体改名为 <缓存>.legacy 并全部保留，
+    第一次完整读取源之后，仍在源中的旧 GUID 移入环形队列，其余丢弃
+    """
+
+    def __init__(self, path: str, capacity: int, bloom_bits: int = 0, bloom_hashes: int = 7):
+        self.path = path
+        self.bloom_path = path + ".bloom"
+        self.legacy_path = path + ".legacy"
+        self.legacy: Set[str] = set()  # 旧版缓存中的 GUID，等待第一次完整读取后清理
+        self.ring: deque = deque()
+        self.index: Set[str] = set()
+        self.capacity = capacity
+        self.pending: List[str] = []  # 尚未写入文件的 GUID
+        self.lines = 0  # 文件当前的行数
+        self.bloom = None
+        if bloom_bits > 0:
+            data = None
+            if os.path.exists(self.bloom_path):
+                with open(self.bloom_path, "rb") as f:
+                    data = f.read()
+            self.bloom = BloomFilter(bloom_bits, bloom_hashes, data)
+        self.load()
+
+    def load(self) -> None:
+        try:
+            if os.path.exists(self.legacy_path):
+                with open(self.legacy_path, "r") as f:
+                    self.legacy = set(json.load(f))
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r") as f:
+                content = f.read()
+            if content.lstrip().startswith("["):
+                # 旧版格式：整个文件是一个 JSON 列表，原样改名保留，新格式从空文件开始
+                self.legacy = set(json.loads(content))
+                os.replace(self.path, self.legacy_path)
+                return
+            for line in content.splitlines():
+                if line:
+                    self._add(json.loads(line))
+                    self.lines += 1
+        except Exception as e:
+            logging.error(f"加载缓存失败: {e}")
+
+    def __contains__(self, guid: str) -> bool:
+        return guid in self.index or guid in self.legacy or (self.bloom is not None and guid in self.bloom)
+
+    def __len__(self) -> int:
+        return len(self.ring)
+
+    def _add(self, guid: str) -> None:
+        if guid in self.index:
+            return
+        self.ring.append(guid)
+        self.index.add(guid)
+        if len(self.ring) > self.capacity:
+            evicted = self.ring.popleft()
+            self.index.discard(evicted)
+            if self.bloom is not None:
+                self.bloom.add(evicted)
+
+    def add(self, guid: str) -> None:
+        if guid not in self.index:
+            self._add(guid)
+            self.pending.append(guid)
+
+    def retire_legacy(self, present: List[str]) -> None:
+        """完整读取源之后调用：present 为本次源中的全部 GUID，仍在源中的旧 GUID 移入环形队列，删除旧版缓存"""
+        if not self.legacy:
+            return
+        for guid in present:
+            if guid in self.legacy:
+                self.add(guid)
+        self.flush()
+        try:
+            os.remove(self.legacy_path)
+        except OSError as e:
+            logging.error(f"删除旧版缓存失败: {e}")
+            return
+        logging.info(f"旧版缓存已转换: {self.path}，保留仍在源中的 {len(self.index)} 条")
+        self.legacy = set()
+
+    def rewrite(self) -> None:
+        """按内存中的环形队列重写文件，同时保存布隆过滤器"""
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            f.writelines(json.dumps(guid) + "\n" for guid in self.ring)
+        os.replace(temp_file, self.path)
+        self.lines = len(self.ring)
+        if self.bloom is not None:
+            with open(self.bloom_path, "wb") as f:
+                f.write(self.bloom.data)
+
+    def flush(self) -> None:
+        """追加写入新的 GUID；文件行数超过容量两倍时改为重写，均摊下来每轮的写入量与新条目数成正比"""
+        try:
+            if self.lines + len(self.pending) > 2 * self.capacity:
+                self.rewrite()
+            elif self.pending:
+                with open(self.path, "a") as f:
+                    f.writelines(json.dumps(guid) + "\n" for guid in self.pending)
+                self.lines += len(self.pending)
+            self.pending = []
+        except Exception as e:
+            logging.error(f"保存缓存失败: {e}")
 
 
-def save_cache(cache_file: str, cache: Set[str]) -> None:
-    """保存缓存"""
-    try:
-        with open(cache_file, "w") as f:
-            json.dump(list(cache), f)
-    except Exception as e:
-        logging.error(f"保存缓存失败: {e}")
+# 缓存文件 -> SeenStore，首次检查时加载，之后常驻内存
+seen_stores: Dict[str, SeenStore] = {}
+seen_stores_lock = threading.Lock()
+
 
+def get_seen_store(cache_file: str) -> SeenStore:
+    with seen_stores_lock:
+        store = seen_stores.get(cache_file)
+        if store is None:
+            store = seen_stores[cache_file] = SeenStore(
+                cache_file, CONFIG["cache_capacity"], CONFIG["cache_bloom_bits"], CONFIG["cache_bloom_hashes"]
+            )
+        return store
+
+
+RDF_ABOUT = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+
+# 源 (source_key) -> 还允许提前停止读取的次数，只有确认新条目排在前面的源才允许
+early_stops: Dict[str, int] = {}
+early_stops_lock = threading.Lock()
+
+
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+# telegram_rss_bot.py 中有一份对应的实现；本脚本按单个文件部署，不能引用该模块，修改时两处需同步
+class FeedStreamReader:
+    """
+    流式读取 RSS/Atom/JSON Feed：XML 按块喂入增量解析器，每个条目只保留标题、链接和 ID
+    超过大小上限或连续遇到已处理的条目后停止读取；格式异常的内容保留原始数据交给 feedparser
+    fast 为 False 时不做快速解析，只按大小上限读取，全部交给 feedparser
+    """
+
+    def __init__(self, max_bytes: int, is_done=None, stop_after: int = 0, fast: bool = True):
+        self.max_bytes = max_bytes
+        self.is_done = is_done  # guid -> 是否已处理过
+        self.stop_after = stop_after
+        self.parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self.path: List[str] = []
+        self.bases: List[str] = []  # 与 path 对应的 xml:base，链接和 ID 按它解析为绝对地址
+        self.root: Optional[str] = None
+        self.chunks: List[bytes] = []  # 原始数据，仅在回退到 feedparser 时使用
+        self.size = 0
+        self.entries: List[feedparser.FeedParserDict] = []
+        self.ttl: Optional[str] = None
+        self.done_streak = 0
+        self.truncated = False  # 超出大小上限
+        self.stopped = False  # 遇到已处理条目，提前停止
+        self.is_json = False
+        self.sniffed = False  # 是否已根据首个非空白字符判断格式
+        self.failed = not fast  # 需要回退到 feedparser
+
+    def feed(self, data: bytes) -> bool:
+        """喂入一块数据，返回 False 表示无需继续读取"""
+        if self.size + len(data) > self.max_bytes:
+            data = data[:self.max_bytes - self.size]
+            self.truncated = True
+        self.size += len(data)
+        self.chunks.append(data)
+        if not self.sniffed:
+            head = b"".join(self.chunks).lstrip(b"\xef\xbb\xbf \t\r\n")
+            if head:
+                self.sniffed = True
+                self.is_json = head.startswith(b"{")
+        if not self.failed and not self.is_json:
+            try:
+                self.parser.feed(data)
+                self._drain()
+            except ElementTree.ParseError:
+                self.failed = True
+        return not (self.truncated or self.stopped)
+
+    def close(self) -> None:
+        """数据读取完毕"""
+        if self.is_json:
+            if not self.failed:
+                self._parse_json()
+            return
+        if not self.failed and not (self.truncated or self.stopped):
+            try:
+                self.parser.close()
+                self._drain()
+            except ElementTree.ParseError:
+                self.failed = True
+        if self.root not in ("rss", "feed", "RDF"):
+            self.failed = True
+
+    def _parse_json(self) -> None:
+        """按 JSON Feed 规范提取 id、url、title"""
+        try:
+            items = json.loads(b"".join(self.chunks))["items"]
+        except (ValueError, KeyError, TypeError):
+            self.failed = True
+            return
+        if not isinstance(items, list):
+            self.failed = True
+            return
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            entry = feedparser.FeedParserDict()
+            if item.get("id") is not None:
+                entry["id"] = str(item["id"])
+            link = item.get("url") or item.get("external_url")
+            if link:
+                entry["link"] = link
+            elif "id" in entry:
+                entry["link"] = entry["id"]
+            else:
+                continue
+            entry["title"] = (item.get("title") or "").strip()
+            self.entries.append(entry)
+
+    def _drain(self) -> None:
+        for event, elem in self.parser.read_events():
+            tag = local_name(elem.tag)
+            if event == "start":
+                if self.root is None:
+                    self.root = tag
+                self.path.append(tag)
+                base = self._base(self.bases[-1] if self.bases else "", elem)
+                if base is None:
+                    self.failed = True
+                    return
+                self.bases.append(base)
+                continue
 
-def fetch_rss(url: str, proxy: Optional[str] = None) -> Optional[feedparser.FeedParserDict]:
-    """抓取 RSS 源并解析"""
+            self.path.pop()
+            base = self.bases.pop()
+            if tag in ("item", "entry"):
+                entry = self._entry(elem, base)
+                elem.clear()
+                if entry is None:
+                    self.failed = True
+                    return
+                self.entries.append(entry)
+                guid = entry.id if "id" in entry else entry.link
+                if self.is_done is not None and self.is_done(guid):
+                    self.done_streak += 1
+                    if self.stop_after and self.done_streak >= self.stop_after:
+                        self.stopped = True
+                        return
+                else:
+                    self.done_streak = 0
+            elif tag == "ttl" and self.path and self.path[-1] == "channel":
+                self.ttl = (elem.text or "").strip()
+
+    @staticmethod
+    def _base(parent: str, elem: ElementTree.Element) -> Optional[str]:
+        """元素的 xml:base 与上层的合并；得到相对地址时返回 None，交给 feedparser 按它的规则处理"""
+        value = elem.get(XML_BASE)
+        if value is None:
+            return parent
+        base = urljoin(parent, value.strip())
+        return base if urlparse(base).scheme else None
+
+    def _entry(self, elem: ElementTree.Element, base: str) -> Optional[feedparser.FeedParserDict]:
+        """
+        提取标题、链接和 ID，与 feedparser 的结果保持一致；遇到需要完整解析的结构时返回 None
+        与 feedparser 相同，链接、Atom id 与作为永久链接的 guid 按 xml:base 解析，rdf:about 保持原样
+        """
+        entry = feedparser.FeedParserDict()
+        permalink = True
+        for child in elem:
+            tag = local_name(child.tag)
+            child_base = self._base(base, child)
+            if child_base is None:
+                return None
+            if tag == "title" and "title" not in entry:
+                if child.get("type") == "xhtml":
+                    return None
+                entry["title"] = "".join(child.itertext()).strip()
+            elif tag == "link" and "link" not in entry:
+                href = child.get("href")
+                if href is None:
+                    if (child.text or "").strip():
+                        entry["link"] = urljoin(child_base, child.text.strip())
+                elif child.get("rel", "alternate") == "alternate":
+                    entry["link"] = urljoin(child_base, href.strip())
+            elif tag in ("guid", "id") and "id" not in entry and (child.text or "").strip():
+                permalink = child.get("isPermaLink", "true") != "false"
+                entry["id"] = urljoin(child_base, child.text.strip()) if permalink else child.text.strip()
+
+        if "id" not in entry and elem.get(RDF_ABOUT):
+            entry["id"] = elem.get(RDF_ABOUT)
+        if "link" not in entry and "id" in entry and permalink:
+            entry["link"] = entry["id"]
+        if "link" not in entry and "id" not in entry:
+            return None
+        entry.setdefault("title", "")
+        return entry
+
+    def result(self) -> feedparser.FeedParserDict:
+        feed = feedparser.FeedParserDict()
+        if self.ttl:
+            feed["ttl"] = self.ttl
+        return feedparser.FeedParserDict(
+            feed=feed, entries=self.entries, partial=self.truncated or self.stopped
+        )
+
+
+def fetch_rss(source: dict, proxy: Optional[str] = None, is_done=None,
+              stop: Optional[threading.Event] = None) -> Optional[feedparser.FeedParserDict]:
+    """
+    流式抓取 RSS 源并解析，内容未变化时返回 NOT_MODIFIED
+    调度、条件请求与提前停止的状态都以 source_key(source) 区分，同一 URL 的多个配置互不影响
+    is_done(guid) 判断条目是否已处理，允许提前停止的源读到连续的已处理条目后停止读取
+    stop 被设置后放弃读取并返回 None（对冲请求中落后的一方）
+    """
+    url = source['url']
+    key = source_key(source)
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-        "Accept": "application/xml, application/rss+xml, text/xml, */*"
+        "Accept": "application/xml, application/rss+xml, text/xml, */*",
+        **validator_store.request_headers(key)
     }
 
     try:
-        with requests.Session() as session:
-            # 添加 http:// 前缀
-            if proxy and not proxy.startswith('http'):
-                proxy = f'http://{proxy}'
-            proxies = {"http": proxy, "https": proxy} if proxy else None
-
-            response = session.get(
-                url,
-                headers=headers,
-                proxies=proxies,
-                timeout=10,
-                verify=False
-            )
+        proxy = normalize_proxy(proxy)
+        proxies = {"http": proxy, "https": proxy} if proxy else None
+        session = session_pool.get(proxy)
+
+        with session.get(
+            url,
+            headers=headers,
+            proxies=proxies,
+            timeout=10,
+            verify=False,
+            stream=True
+        ) as response:
+            feed_scheduler.note_response(key, response)
+            if response.status_code == 304:
+                validator_store.record_not_modified(key)
+                # 读完空响应体，连接归还连接池，而不是在退出 with 时被关闭
+                response.content
+                return NOT_MODIFIED
             response.raise_for_status()
-            feed = feedparser.parse(response.content)
-            return feed if feed.entries else None
+
+            stop_after = CONFIG["early_stop_seen"] if early_stops.get(key, 0) > 0 else 0
+            reader = FeedStreamReader(CONFIG["max_feed_bytes"], is_done, stop_after, CONFIG["fast_parser"])
+            # iter_content 按块解压，内存占用不随响应体大小增长
+            for chunk in response.iter_content(chunk_size=65536):
+                if stop is not None and stop.is_set():
+                    return None
+                if not reader.feed(chunk):
+                    break
+            reader.close()
+
+        validator_store.update(key, response, reader.size)
+        if reader.truncated:
+            logging.warning(f"[{url.split('//')[-1]}] 内容超过 {CONFIG['max_feed_bytes']} 字节，已截断")
+        if reader.failed:
+            feed = feedparser.parse(b"".join(reader.chunks))
+            feed["partial"] = reader.truncated
+        else:
+            feed = reader.result()
+        return feed if feed.entries else None
     except Exception as e:
         logging.error(f"[{url.split('//')[-1]}] 抓取失败: {str(e)}")
         return None
 
 
-def push_notification(title: str, link: str, group: str) -> None:
-    """发送通知"""
-    try:
-        push_content = link
+class PushQueue:
+    """
+    后台推送队列：匹配到的条目放入有界队列后立即返回，由 workers 个线程通过连接池发送，抓取和匹配不再等待 Bark
+    网络错误、429、5xx 按指数退避重试（优先使用 Retry-After）；batch 大于 1 时同一分组的多条合并为一次推送
+    线程在第一次推送时才启动
+    """
+
+    def __init__(self, workers: int, size: int, retries: int, backoff: float, batch: int, batch_wait: float):
+        self.workers = workers
+        self.queue: queue.Queue = queue.Queue(maxsize=size)
+        self.retries = retries
+        self.backoff = backoff
+        self.batch = max(1, batch)
+        self.batch_wait = batch_wait
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+
+    def submit(self, title: str, link: str, group: str) -> None:
+        if self.workers <= 0:
+            self.deliver(group, [(title, link)])
+            return
+        with self.lock:
+            if not self.threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._worker, name=f"bark-push-{i}", daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+        if self.queue.full():
+            logging.warning("推送队列已满，等待发送...")
+        self.queue.put((title, link, group))
+
+    def _worker(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                return
+            items = [item]
+            # 合并推送：在 batch_wait 内继续收集，最多 batch 条
+            deadline = time.monotonic() + self.batch_wait
+            while len(items) < self.batch:
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                items.append(item)
+
+            groups: Dict[str, List[Tuple[str, str]]] = {}
+            for title, link, group in items:
+                groups.setdefault(group, []).append((title, link))
+            for group, entries in groups.items():
+                self.deliver(group, entries)
+
+    def deliver(self, group: str, entries: List[Tuple[str, str]]) -> bool:
+        """发送一次推送，多条时标题为第一条加总数，内容为各条的标题和链接"""
+        if len(entries) == 1:
+            title, push_content = entries[0]
+        else:
+            title = f"{entries[0][0]} 等 {len(entries)} 条"
+            push_content = "\n\n".join(f"{entry_title}\n{link}" for entry_title, link in entries)
         encoded_title = urllib.parse.quote(title, safe="")
         encoded_content = urllib.parse.quote(push_content, safe="")
         push_url = f"{CONFIG['bark_url']}/{encoded_title}/{encoded_content}{group}"
 
-        response = requests.get(push_url, timeout=10)
-        if response.status_code == 200:
-            logging.info(f"推送成功: {title}")
-        else:
-            logging.error(f"推送失败: {title}. 响应: {response.text}")
-    except Exception as e:
-        logging.error(f"推送失败: {title} - {str(e)}")
+        for attempt in range(self.retries + 1):
+            delay = 0
+            try:
+                response = session_pool.get_push().get(push_url, timeout=10)
+                if response.status_code == 200:
+                    logging.info(f"推送成功: {title}")
+                    return True
+                error = f"响应: {response.text}"
+                retry = response.status_code == 429 or response.status_code >= 500
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+            except Exception as e:
+                error = str(e)
+                retry = True
+            if not retry or attempt == self.retries:
+                break
+            time.sleep(max(delay, self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)))
+
+        logging.error(f"推送失败: {title} - {error}")
+        return False
 
+    def close(self, timeout: float) -> None:
+        """等待已排队的推送发送完毕，最多 timeout 秒"""
+        with self.lock:
+            threads, self.threads = self.threads, []
+        if not threads:
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            for _ in threads:
+                self.queue.put(None, timeout=max(0, deadline - time.monotonic()))
+        except queue.Full:
+            pass
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if self.queue.qsize():
+            logging.warning(f"退出时仍有约 {self.queue.qsize()} 条推送未发送")
+
+
+push_queue = PushQueue(
+    CONFIG["push_workers"], CONFIG["push_queue_size"], CONFIG["push_retries"],
+    CONFIG["push_backoff"], CONFIG["push_batch"], CONFIG["push_batch_wait"]
+)
+
+
+def push_notification(title: str, link: str, group: str) -> None:
+    """发送通知：放入后台推送队列，push_workers 为 0 时直接发送"""
+    push_queue.submit(title, link, group)
 
-def process_feed_entries(entries: list, source: dict) -> None:
-    """处理RSS条目"""
-    cached_guids = load_cache(source['cache_file'])
-    new_guids = set()
 
+def process_feed_entries(entries: list, source: dict, cached_guids: SeenStore, partial: bool = False) -> int:
+    """处理RSS条目，返回新条目数"""
+    new_guids = 0
+    # 新条目是否都排在已知条目之前：None 为无法判断，用于决定之后能否提前停止读取
+    newest_first = None
+    known_seen = False
+
+    present = []
     for entry in entries:
         guid = getattr(entry, 'id', entry.link)
+        present.append(guid)
         if guid in cached_guids:
+            known_seen = True
             continue
+        if newest_first is not False:
+            newest_first = not known_seen
 
         title = entry.title
         link = getattr(entry, 'link', "No link available.")
 
-        for keyword in source['keywords']:
-            if match_keywords(title, keyword):
-                push_notification(title, link, source['group'])
-                break
+        if match_keywords(title, source['keywords']):
+            push_notification(title, link, source['group'])
 
-        new_guids.add(guid)
+        cached_guids.add(guid)
+        new_guids += 1
 
-    save_cache(source['cache_file'], cached_guids | new_guids)
+    if not partial:
+        cached_guids.retire_legacy(present)
+    cached_guids.flush()
 
+    key = source_key(source)
+    with early_stops_lock:
+        if partial:
+            early_stops[key] = early_stops.get(key, 0) - 1
+        elif known_seen and newest_first is not None:
+            early_stops[key] = CONFIG["early_stop_recheck"] if newest_first else 0
+    return new_guids
 
-def check_rss_source(source: dict, proxies: list, proxy_manager: ProxyManager) -> None:
-    """检查单个RSS源"""
+
+def fetch_via_proxy(source: dict, proxy: str, proxy_manager: ProxyManager, is_done,
+                    stop: Optional[threading.Event] = None) -> Optional[feedparser.FeedParserDict]:
+    """通过代理抓取一次并记录结果；被 stop 取消的失败请求只归还代理，不计入代理的失败"""
+    source_url = source['url']
+    started = time.monotonic()
+    feed = fetch_rss(source, proxy, is_done, stop)
+    success = feed is NOT_MODIFIED or bool(feed and feed.entries)
+    if not success and stop is not None and stop.is_set():
+        proxy_manager.release_proxy(source_url, proxy, time.monotonic() - started)
+    else:
+        proxy_manager.update_proxy_result(source_url, proxy, success, time.monotonic() - started)
+    return feed
+
+
+def fetch_hedged(source: dict, proxy: str, proxies: list, proxy_manager: ProxyManager,
+                 is_done) -> Optional[feedparser.FeedParserDict]:
+    """
+    通过代理抓取，开启 hedge_requests 且耗时超过该代理的 p90 时，再通过另一个就绪的代理发出一次请求
+    取先成功返回的结果，另一个请求随即停止读取；约 10% 的请求会被对冲，请求量不会成倍增加
+    """
+    source_url = source['url']
+    delay = proxy_manager.latency_quantile(source_url, proxy) if CONFIG["hedge_requests"] else None
+    if delay is None:
+        return fetch_via_proxy(source, proxy, proxy_manager, is_done)
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        stop = threading.Event()
+        stops = {executor.submit(fetch_via_proxy, source, proxy, proxy_manager, is_done, stop): stop}
+        done, _ = wait(stops, timeout=delay)
+        backup = None if done else proxy_manager.select_proxy(source_url, proxies, ready_only=True)
+        if backup:
+            logging.info(f"[{source_url.split('//')[-1]}] 代理 {proxy} 超过 p90 耗时 {delay:.1f}s，对冲请求 - 代理: {backup}")
+            stop = threading.Event()
+            stops[executor.submit(fetch_via_proxy, source, backup, proxy_manager, is_done, stop)] = stop
+
+        feed = None
+        while stops:
+            done, _ = wait(stops, return_when=FIRST_COMPLETED)
+            for future in done:
+                stops.pop(future)
+                feed = future.result()
+                if feed is NOT_MODIFIED or (feed and feed.entries):
+                    for stop in stops.values():
+                        stop.set()
+                    return feed
+        return feed
+    finally:
+        # 不等待落后的请求，它读到下一块数据时会停止并归还代理
+        executor.shutdown(wait=False)
+
+
+def check_rss_source(source: dict, proxies: list, proxy_manager: ProxyManager) -> Optional[int]:
+    """检查单个RSS源，返回新条目数，内容未变化时为 0，失败时为 None"""
     source_url = source['url']
     display_url = source_url.split('//')[-1]
+    cached_guids = get_seen_store(source['cache_file'])
 
     if CONFIG['use_proxy'].lower() == "yes":
         for attempt in range(CONFIG['max_retries']):
             if not running:
-                return
+                return None
 
             proxy = proxy_manager.select_proxy(source_url, proxies)
             if not proxy:
-                logging.error("无可用代理")
-                return
+                logging.error(f"[{display_url}] 无可用代理")
+                return None
 
             logging.info(f"[{display_url}] 尝试 {attempt + 1}/{CONFIG['max_retries']} - 代理: {proxy}")
-            feed = fetch_rss(source_url, proxy)
-            success = bool(feed and feed.entries)
+            feed = fetch_hedged(source, proxy, proxies, proxy_manager, cached_guids.__contains__)
+            success = feed is NOT_MODIFIED or bool(feed and feed.entries)
 
-            proxy_manager.update_proxy_result(source_url, proxy, success)
+            if feed is NOT_MODIFIED:
+                logging.info(f"[{display_url}] 内容未变化，跳过解析")
+                return 0
 
             if success:
-                process_feed_entries(feed.entries, source)
+                feed_scheduler.note_feed(source_key(source), feed)
+                new_entries = process_feed_entries(feed.entries, source, cached_guids, feed.get("partial", False))
                 logging.info(f"[{display_url}] 成功获取 {len(feed.entries)} 条")
-                return
+                return new_entries
 
+            # 失败的代理已进入冷却，下一次尝试会换用健康分最高的就绪代理，不再固定等待
             logging.error(f"[{display_url}] 使用代理 {proxy} 获取失败")
-            time.sleep(2)
 
         logging.error(f"[{display_url}] 全部尝试失败")
     else:
         logging.info(f"[{display_url}] 使用本机IP尝试获取")
-        feed = fetch_rss(source_url)
-
-        if feed and feed.entries:
-            process_feed_entries(feed.entries, source)
+        feed = fetch_rss(source, is_done=cached_guids.__contains__)
+
+        if feed is NOT_MODIFIED:
+            logging.info(f"[{display_url}] 内容未变化，跳过解析")
+            return 0
+        elif feed and feed.entries:
+            feed_scheduler.note_feed(source_key(source), feed)
+            new_entries = process_feed_entries(feed.entries, source, cached_guids, feed.get("partial", False))
             logging.info(f"[{display_url}] 成功获取 {len(feed.entries)} 条")
+            return new_entries
         else:
             logging.error(f"[{display_url}] 获取失败")
+    return None
+
+
+def check_sources(due_sources: List[dict], proxies: list, proxy_manager: ProxyManager) -> Dict[str, Optional[int]]:
+    """
+    检查一批到期的源，返回 source_key -> 新条目数（失败为 None）
+    max_workers 大于 1 时用线程池并发检查，同一域名同时进行的检查数不超过 per_domain_limit（使用代理时也不超过代理数）
+    """
+    limit = CONFIG["per_domain_limit"]
+    if proxies:
+        limit = min(limit, len(proxies))
+    domain_slots: Dict[str, threading.BoundedSemaphore] = {}
+    slots_lock = threading.Lock()
+
+    def check(source: dict) -> Optional[int]:
+        domain = proxy_manager.get_domain(source['url'])
+        with slots_lock:
+            slot = domain_slots.setdefault(domain, threading.BoundedSemaphore(max(1, limit)))
+        with slot:
+            if not running:
+                return None
+            try:
+                return check_rss_source(source, proxies, proxy_manager)
+            except Exception as e:
+                logging.error(f"检查失败: {source['url']} - {str(e)}")
+                return None
+
+    if CONFIG["max_workers"] <= 1 or len(due_sources) <= 1:
+        results = {}
+        for source in due_sources:
+            results[source_key(source)] = check(source)
+            if not running:
+                break
+        return results
+
+    with ThreadPoolExecutor(max_workers=CONFIG["max_workers"]) as executor:
+        futures = {executor.submit(check, source): source_key(source) for source in due_sources}
+        return {futures[future]: future.result() for future in as_completed(futures)}
+
+
+def sleep_while_running(seconds: float) -> None:
+    """分段等待，收到退出信号后 1 秒内返回（time.sleep 不会被只设置标志的信号处理函数打断）"""
+    deadline = time.time() + seconds
+    while running:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        time.sleep(min(1, remaining))
 
 
 def main():
     """主函数"""
-    proxy_manager = ProxyManager(cooldown=300)  # 5分钟冷却时间
+    global proxy_manager
+    proxy_manager = ProxyManager(cooldown=300, state_file=CONFIG["proxy_state_file"])  # 5分钟冷却时间
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
     logging.info("RSS监控启动")
     logging.info(f"当前模式: {'使用代理' if CONFIG['use_proxy'].lower() == 'yes' else '使用本机IP'}")
 
+    # 以缓存文件区分各源，同一 URL 可以配置多次（不同关键词、分组）
+    sources = {source_key(source): source for source in RSS_SOURCES}
+    last_proxies = None
+    last_state_save = time.time()
+
     while running:
         try:
-            proxies = load_proxies() if CONFIG['use_proxy'].lower() == "yes" else []
-            if CONFIG['use_proxy'].lower() == "yes" and not proxies:
-                logging.warning("无可用代理，等待下次检查...")
-                time.sleep(CONFIG['proxy_interval'])
-                continue
-
-            if CONFIG['use_proxy'].lower() == "yes":
-                logging.info(f"当前代理数量: {len(proxies)}")
-                logging.info("\n" + proxy_manager.get_proxy_stats())
-
-            for source in RSS_SOURCES:
-                try:
-                    check_rss_source(source, proxies, proxy_manager)
-                except Exception as e:
-                    logging.error(f"检查失败: {source['url']} - {str(e)}")
-
-                if not running:
-                    break
-
+            # 各源按自己的间隔调度，只检查已到期的源
+            feed_scheduler.sync(sources)
+            due_keys = feed_scheduler.pop_due()
+
+            if due_keys:
+                proxies = load_proxies() if CONFIG['use_proxy'].lower() == "yes" else []
+                if CONFIG['use_proxy'].lower() == "yes" and not proxies:
+                    logging.warning("无可用代理，等待下次检查...")
+                    for key in due_keys:
+                        feed_scheduler.reschedule(key, None)
+                    continue
+
+                if CONFIG['use_proxy'].lower() == "yes":
+                    if proxies is not last_proxies:
+                        session_pool.prune(proxies)
+                        last_proxies = proxies
+                    logging.info(f"当前代理数量: {len(proxies)}")
+                    logging.info("\n" + proxy_manager.get_proxy_stats())
+
+                results = check_sources([sources[key] for key in due_keys], proxies, proxy_manager)
+                for key, new_entries in results.items():
+                    feed_scheduler.reschedule(key, new_entries)
+
+                validator_store.save()
+                logging.info(validator_store.get_stats())
+
+            if time.time() - last_state_save >= CONFIG["proxy_state_interval"]:
+                proxy_manager.save()
+                last_state_save = time.time()
+
+            wakeup = feed_scheduler.next_wakeup()
             if running:
-                interval = CONFIG['proxy_interval'] if CONFIG['use_proxy'].lower() == "yes" else CONFIG['local_interval']
-                logging.info(f"完成检查，等待 {interval} 秒后进行下次检查...")
-                time.sleep(interval)
+                wait = max(0, wakeup - time.time()) if wakeup is not None else feed_scheduler.base_interval
+                if due_keys:
+                    logging.info(f"完成检查，等待 {wait:.0f} 秒后进行下次检查...")
+                sleep_while_running(wait)
 
         except Exception as e:
             logging.error(f"运行错误: {str(e)}")
             interval = CONFIG['proxy_interval'] if CONFIG['use_proxy'].lower() == "yes" else CONFIG['local_interval']
-            time.sleep(interval)
+            sleep_while_running(interval)
 
+    push_queue.close(CONFIG["push_drain_timeout"])
+    proxy_manager.save()
+    session_pool.close()
     logging.info("程序已安全退出")
 
 
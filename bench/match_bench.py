@@ -0,0 +1,115 @@
+"""
++A+B-C 关键词规则：旧的正则逐条匹配与现在的词集合匹配的耗时对比
+
+在仓库根目录运行：python bench/match_bench.py
+标题与规则按固定随机种子生成：约 150 字的中文长标题，规则词取自同一词表，部分标题能命中。
+Bot：旧做法对每个订阅者的每条规则执行 create_regex_pattern 生成的 ^(?!.*C)(?=.*A)(?=.*B).*$ 正则，
+新做法为 FeedMatcher 一次扫描标题。Bark：旧做法每个词执行一次 .*词.* 正则，新做法为 match_keywords。
+两种做法的匹配结果先逐条核对一致，再计时。
+"""
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Bark"))
+
+import telegram_rss_bot as bot  # noqa: E402
+import bark_mix as bark  # noqa: E402
+
+SUBSCRIBERS = 500
+RULES_PER_SUBSCRIBER = 2
+TITLES = 100
+TITLE_WORDS = 75  # 每个词两个汉字，约 150 字
+
+
+def make_inputs():
+    rng = random.Random(3)
+    vocabulary = [chr(rng.randint(0x4E00, 0x4FFF)) + chr(rng.randint(0x4E00, 0x4FFF)) for _ in range(400)]
+    fillers = ["，", "VPS ", "优惠", "黑五"]
+
+    def rule():
+        include = rng.sample(vocabulary, 2)
+        return "+" + "+".join(include) + "-" + rng.choice(vocabulary)
+
+    rules = [[rule() for _ in range(RULES_PER_SUBSCRIBER)] for _ in range(SUBSCRIBERS)]
+    titles = ["".join(rng.choice(vocabulary + fillers) for _ in range(TITLE_WORDS)) for _ in range(TITLES)]
+    return rules, titles
+
+
+def old_bark_match(text, pattern):
+    # 改动前 Bark 的 match_keywords：每个词单独执行一次 .*词.* 正则
+    if pattern.startswith('+'):
+        terms = pattern.split('+')[1:]
+        include_terms = [t for t in terms if not t.startswith('-')]
+        exclude_terms = [t[1:] for t in terms if t.startswith('-')]
+        return (
+            all(re.search(f".*{re.escape(term)}.*", text, re.I) for term in include_terms) and
+            not any(re.search(f".*{re.escape(term)}.*", text, re.I) for term in exclude_terms)
+        )
+    return bool(re.search(f".*{re.escape(pattern)}.*", text, re.I))
+
+
+def per_title_ms(fn, titles):
+    start = time.perf_counter()
+    results = [fn(title) for title in titles]
+    return (time.perf_counter() - start) / len(titles) * 1000, results
+
+
+def bench_bot(rules, titles):
+    subscribers = [
+        (str(i), {"url": "u", "keywords": keywords,
+                  "regex_patterns": [bot.create_regex_pattern(k) for k in keywords], "regex_keywords": []})
+        for i, keywords in enumerate(rules)
+    ]
+    compiled = [
+        (chat_id, [re.compile(p, re.IGNORECASE) for p in rss["regex_patterns"]])
+        for chat_id, rss in subscribers
+    ]
+
+    def old(title):
+        return [chat_id for chat_id, patterns in compiled if any(p.search(title) for p in patterns)]
+
+    matcher = bot.FeedMatcher(subscribers)
+
+    def new(title):
+        return [chat_id for chat_id, _, _ in matcher.match(title)]
+
+    old_ms, old_results = per_title_ms(old, titles)
+    new_ms, new_results = per_title_ms(new, titles)
+    assert old_results == new_results
+    hits = sum(map(len, new_results))
+    print(f"Bot  {SUBSCRIBERS * RULES_PER_SUBSCRIBER} 条规则，{hits} 次命中：前瞻正则 {old_ms:.2f} ms/标题，"
+          f"FeedMatcher {new_ms:.3f} ms/标题 (x{old_ms / new_ms:.0f})")
+
+
+def bench_bark(rules, titles):
+    patterns = [rule for keywords in rules for rule in keywords]
+
+    def old(title):
+        return next((p for p in patterns if old_bark_match(title, p)), None)
+
+    def new(title):
+        return bark.match_keywords(title, patterns)
+
+    new(titles[0])  # 规则解析结果有缓存，先预热
+    old_ms, old_results = per_title_ms(old, titles)
+    new_ms, new_results = per_title_ms(new, titles)
+    assert old_results == new_results
+    print(f"Bark {len(patterns)} 条规则：逐词正则 {old_ms:.2f} ms/标题，"
+          f"match_keywords {new_ms:.3f} ms/标题 (x{old_ms / new_ms:.0f})")
+
+
+def main():
+    rules, titles = make_inputs()
+    print(f"{TITLES} 个标题，平均 {sum(map(len, titles)) // len(titles)} 字")
+    bench_bot(rules, titles)
+    bench_bark(rules, titles)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+快速解析 (FEED_PARSER=fast) 与 feedparser 完整解析的耗时对比
+
+在仓库根目录运行：python bench/parse_bench.py [feed 文件 ...]
+内置样本按固定随机种子生成，结构仿照 NodeSeek (RSS 2.0) 与 V2EX (Atom) 的真实输出；
+也可以传入保存下来的真实源文件一起对比。每个样本先确认两种解析得到的标题/链接/ID 完全一致。
+"""
+import html
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import feedparser  # noqa: E402
+import telegram_rss_bot as bot  # noqa: E402
+
+WORDS = "VPS 黑五 优惠 咸鱼云 DMIT 补货 测评 线路 CN2 GIA 香港 日本 美国 年付 月付 限时 折扣 服务器 带宽 流量".split()
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def paragraphs(rng, n):
+    return "".join(
+        f'<p>{sentence(rng, 12)} <a href="https://example.com/{i}">link</a> <img src="/img/{i}.png"/></p>'
+        for i in range(n)
+    )
+
+
+def nodeseek_rss(items, paras):
+    rng = random.Random(1)
+    body = "".join(
+        f"<item><title><![CDATA[{sentence(rng, 6)} &amp; {i}]]></title>"
+        f"<link>https://www.nodeseek.com/post-{i}-1</link>"
+        f"<description><![CDATA[{paragraphs(rng, paras)}]]></description>"
+        f'<guid isPermaLink="false">{i}</guid><dc:creator><![CDATA[user{i}]]></dc:creator>'
+        f"<category><![CDATA[trade]]></category><pubDate>Sat, 17 Oct 2026 0{i % 10}:00:00 GMT</pubDate></item>\n"
+        for i in range(items, 0, -1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:atom="http://www.w3.org/2005/Atom">'
+        '<channel><title>NodeSeek</title><link>https://www.nodeseek.com</link>'
+        f'<atom:link href="https://rss.nodeseek.com/" rel="self"/><ttl>5</ttl>{body}</channel></rss>'
+    ).encode()
+
+
+def v2ex_atom(entries, paras):
+    rng = random.Random(2)
+    body = "".join(
+        f"<entry><title>{html.escape(sentence(rng, 8))}</title>"
+        f'<link rel="alternate" type="text/html" href="https://www.v2ex.com/t/{i}#reply3"/>'
+        f"<id>tag:www.v2ex.com,2026-10-17:/t/{i}</id>"
+        "<published>2026-10-17T01:00:00Z</published><updated>2026-10-17T01:00:00Z</updated>"
+        f"<author><name>u{i}</name><uri>https://www.v2ex.com/member/u{i}</uri></author>"
+        f'<content type="html" xml:base="https://www.v2ex.com/" xml:lang="en">{html.escape(paragraphs(rng, paras))}</content>'
+        "</entry>\n"
+        for i in range(entries, 0, -1)
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+        '<title>V2EX</title><link rel="alternate" href="https://www.v2ex.com/"/>'
+        '<link rel="self" href="https://www.v2ex.com/index.xml"/><id>https://www.v2ex.com/</id>'
+        f"<updated>2026-10-17T01:00:00Z</updated>{body}</feed>"
+    ).encode()
+
+
+def json_feed(items, paras):
+    rng = random.Random(3)
+    return json.dumps({
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": "JSON Feed",
+        "items": [
+            {"id": str(i), "url": f"https://example.com/{i}", "title": sentence(rng, 6),
+             "content_html": paragraphs(rng, paras), "date_published": "2026-10-17T01:00:00Z"}
+            for i in range(items, 0, -1)
+        ],
+    }, ensure_ascii=False).encode()
+
+
+def fast_parse(data):
+    # 与抓取时相同：按 64 KiB 分块喂给增量解析器
+    reader = bot.FeedStreamReader(len(data) + 1)
+    for start in range(0, len(data), 65536):
+        reader.feed(data[start:start + 65536])
+    reader.close()
+    if reader.failed:
+        raise ValueError("fast parser fell back to feedparser")
+    return reader.result()
+
+
+def fields(parsed):
+    return [(e.get("title"), e.get("link"), e.get("id")) for e in parsed.entries]
+
+
+def timeit(fn, data, repeat):
+    fn(data)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(data)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    samples = [
+        ("NodeSeek 式 RSS 2.0 (50 条)", nodeseek_rss(50, 3)),
+        ("V2EX 式 Atom (50 条)", v2ex_atom(50, 4)),
+        ("全文 RSS 2.0 (500 条)", nodeseek_rss(500, 12)),
+        ("JSON Feed 1.1 (50 条)", json_feed(50, 3)),
+    ]
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            samples.append((os.path.basename(path), f.read()))
+
+    for name, data in samples:
+        repeat = 5 if len(data) > 1024 * 1024 else 20
+        fast_ms = timeit(fast_parse, data, repeat)
+        reference = feedparser.parse(data)
+        if not reference.entries:
+            # feedparser 6 不支持 JSON Feed
+            print(f"{name}: {len(data) / 1024:.0f} KiB  fast {fast_ms:.2f} ms  feedparser 不支持")
+            continue
+        if fields(fast_parse(data)) != fields(reference):
+            print(f"{name}: 两种解析结果不一致")
+            continue
+        full_ms = timeit(feedparser.parse, data, repeat)
+        print(f"{name}: {len(data) / 1024:.0f} KiB  feedparser {full_ms:.1f} ms  "
+              f"fast {fast_ms:.2f} ms  x{full_ms / fast_ms:.0f}")
+
+
+if __name__ == "__main__":
+    main()
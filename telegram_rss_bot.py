@@ -1,23 +1,82 @@
+from telegram.error import RetryAfter, TelegramError, TimedOut, NetworkError
 from telegram.ext import Application, CommandHandler
 from telegram.helpers import escape_markdown
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse
+from xml.etree import ElementTree
+import asyncio
 import feedparser
-import requests
+import hashlib
+import heapq
+import httpx
 import os
 import json
+import multiprocessing
+import random
 import re
+import sqlite3
+import time
+
+try:
+    from re._casefix import _EXTRA_CASES as _RE_EXTRA_CASES  # Python 3.11+
+except ImportError:
+    try:
+        from sre_compile import _ignorecase_fixes as _RE_EXTRA_CASES  # Python 3.7 ~ 3.10
+    except ImportError:
+        _RE_EXTRA_CASES = {}
 
 # 配置 - 从环境变量读取
-CACHE_FILE = "./data/rss_cache3.txt"  # 本地缓存文件
+CACHE_FILE = "./data/rss_cache3.txt"  # 旧版本地缓存文件，启动时迁移到 SEEN_DB_FILE
+SEEN_DB_FILE = "./data/seen.db"  # 已处理条目存储 (SQLite)
+OUTBOX_FILE = "./data/outbox.log"  # 待推送消息发件箱（追加写入）
 USER_DATA_FILE = "./data/user_data.json"  # 存储用户规则和 RSS 源
 ALLOWED_USERS_FILE = "./data/allowed_users.json"  # 存储白名单的文件
 WHITELIST_STATUS_FILE = "./data/whitelist_status.json"  # 白名单模式状态文件
+VALIDATORS_FILE = "./data/http_validators.json"  # 各源的 ETag/Last-Modified，用于条件请求
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ROOT_ID = int(os.getenv('ROOT_ID', 0))
 WHITELIST_GROUP_ID = os.getenv('WHITELIST_GROUP_ID', '')
 ENABLE_GROUP_VERIFY = os.getenv('ENABLE_GROUP_VERIFY', 'false').lower() == 'true'
 UPDATE_INTERVAL = int(os.getenv('UPDATE_INTERVAL', 300))
+FEED_MIN_INTERVAL = int(os.getenv('FEED_MIN_INTERVAL', max(30, UPDATE_INTERVAL // 5)))  # 单个源最短抓取间隔(秒)
+FEED_MAX_INTERVAL = int(os.getenv('FEED_MAX_INTERVAL', UPDATE_INTERVAL * 6))  # 单个源最长抓取间隔(秒)
+SCHEDULER_TICK = int(os.getenv('SCHEDULER_TICK', 10))  # 检查到期源的间隔(秒)
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 20))  # 同时抓取的 RSS 源数量上限
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', 10))  # 单次抓取超时(秒)
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', FETCH_CONCURRENCY))  # 每批处理的到期源数量
+SWEEP_TIME_BUDGET = float(os.getenv('SWEEP_TIME_BUDGET', 60))  # 单次抓取任务的时间片(秒)，超出后剩余的源留到下次
+FEED_TIME_BUDGET = float(os.getenv('FEED_TIME_BUDGET', FETCH_TIMEOUT * 3))  # 单个源下载的总时间上限(秒)
+MAX_FEED_BYTES = int(os.getenv('MAX_FEED_BYTES', 5 * 1024 * 1024))  # 单个源解压后读取的最大字节数
+FAST_PARSER = os.getenv('FEED_PARSER', 'fast').lower() != 'feedparser'  # fast: 只提取标题/链接/ID 的快速解析；feedparser: 完整解析
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', 0))  # 解析与匹配的工作进程数，0 为在主进程中执行
+EARLY_STOP_SEEN = int(os.getenv('EARLY_STOP_SEEN', 3))  # 连续遇到这么多已处理条目后停止读取，0 为关闭
+EARLY_STOP_RECHECK = int(os.getenv('EARLY_STOP_RECHECK', 10))  # 每提前停止这么多次后完整读取一次，重新确认源的排序
+SEEN_MAX_PER_FEED = int(os.getenv('SEEN_MAX_PER_FEED', 1000))  # 每个源最多保留的已处理条目数
+SEEN_TTL_DAYS = int(os.getenv('SEEN_TTL_DAYS', 30))  # 已处理条目保留天数
+SEEN_COMPACT_INTERVAL = int(os.getenv('SEEN_COMPACT_INTERVAL', 3600))  # 清理已处理条目的间隔(秒)
+USER_DATA_FLUSH_DELAY = float(os.getenv('USER_DATA_FLUSH_DELAY', 2))  # 用户数据修改后延迟写盘(秒)
+GROUP_VERIFY_TTL = int(os.getenv('GROUP_VERIFY_TTL', 600))  # 进群验证通过结果的缓存时间(秒)
+GROUP_VERIFY_NEGATIVE_TTL = int(os.getenv('GROUP_VERIFY_NEGATIVE_TTL', 60))  # 进群验证未通过结果的缓存时间(秒)
+GROUP_VERIFY_CACHE_SIZE = int(os.getenv('GROUP_VERIFY_CACHE_SIZE', 10000))  # 进群验证缓存的最大用户数
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 4))  # 推送并发数
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 25))  # 全局每秒最多推送条数
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))  # 单个聊天每秒最多推送条数
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 5))  # 推送失败最大重试次数
+DIGEST_MODE = os.getenv('DIGEST_MODE', 'false').lower() == 'true'  # 同一聊天积压的多条推送合并为一条消息
+DIGEST_MAX_ITEMS = int(os.getenv('DIGEST_MAX_ITEMS', 10))  # 合并推送时每条消息最多包含的条目数
+OUTBOX_DEDUP_SIZE = int(os.getenv('OUTBOX_DEDUP_SIZE', 10000))  # 发件箱记住的已完成推送数量，用于去重
+WHITELIST_RELOAD_INTERVAL = int(os.getenv('WHITELIST_RELOAD_INTERVAL', 60))  # 检查白名单文件外部修改的间隔(秒)，0 为关闭
+
+FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
+    "Accept": "application/rss+xml, application/xml, text/xml",
+    "Referer": "https://www.google.com",
+    "Accept-Language": "en-US,en;q=0.9",
+}
 
 # 确保数据目录存在
 os.makedirs('data', exist_ok=True)
@@ -38,15 +97,112 @@ def load_allowed_users():
 def save_allowed_users(users):
     with open(ALLOWED_USERS_FILE, "w") as f:
         json.dump(list(users), f)
+    _whitelist_mtimes[ALLOWED_USERS_FILE] = file_mtime(ALLOWED_USERS_FILE)
+
+
+# 白名单及其开关常驻内存，启动时加载，/add_user 与 /whitelist 同步更新
+allowed_users = set()
+whitelist_enabled = False
+_whitelist_mtimes = {}
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def load_whitelist_state():
+    global allowed_users, whitelist_enabled
+    allowed_users = load_allowed_users()
+    whitelist_enabled = load_whitelist_status()
+    for path in (ALLOWED_USERS_FILE, WHITELIST_STATUS_FILE):
+        _whitelist_mtimes[path] = file_mtime(path)
+
+
+# 定时检查白名单文件是否被外部修改，有变化时重新加载
+async def reload_whitelist_if_changed(context):
+    for path in (ALLOWED_USERS_FILE, WHITELIST_STATUS_FILE):
+        if file_mtime(path) != _whitelist_mtimes.get(path):
+            load_whitelist_state()
+            print("Whitelist files changed, reloaded")
+            return
 
 
 def is_allowed_user(user_id):
-    if not is_whitelist_enabled():
+    if not whitelist_enabled:
         return True
-    allowed_users = load_allowed_users()
     return user_id in allowed_users
 
 
+class MembershipCache:
+    """
+    进群验证结果缓存：成员与非成员分别设置有效期，超出容量时淘汰最久未使用的用户
+    同一用户的并发查询合并为一次 Telegram API 请求
+    """
+
+    def __init__(self, ttl, negative_ttl, max_size):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # user_id -> (是否为成员, 过期时间)
+        self.inflight = {}  # user_id -> 进行中的查询
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id, lookup):
+        """lookup 为返回 True/False 的协程函数，查询失败返回 None（不缓存）"""
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        task = self.inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(user_id, lookup))
+            self.inflight[user_id] = task
+        # shield：某个等待者被取消时不影响其他等待同一查询的命令
+        return await asyncio.shield(task)
+
+    async def _lookup(self, user_id, lookup):
+        try:
+            is_member = await lookup()
+        finally:
+            self.inflight.pop(user_id, None)
+
+        if is_member is None:
+            return False
+
+        ttl = self.ttl if is_member else self.negative_ttl
+        self.entries[user_id] = (is_member, time.monotonic() + ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return is_member
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return f"缓存命中 {self.hits} 次，未命中 {self.misses} 次，当前缓存 {len(self.entries)} 个用户"
+
+
+membership_cache = MembershipCache(GROUP_VERIFY_TTL, GROUP_VERIFY_NEGATIVE_TTL, GROUP_VERIFY_CACHE_SIZE)
+
+
+# 通过 Telegram API 查询用户是否在群组中，查询失败返回 None
+async def fetch_group_membership(user_id, context):
+    try:
+        member = await context.bot.get_chat_member(WHITELIST_GROUP_ID, user_id)
+        return member.status in ["member", "administrator", "creator"]
+    except Exception as e:
+        print(f"Error checking if user {user_id} is in group: {e}")
+        return None
+
+
 # 检查用户是否在特定群组中
 async def is_user_in_group(user_id, context):
     # 如果白名单已关闭（WHITELIST_GROUP_ID = false），直接返回 True
@@ -57,13 +213,8 @@ async def is_user_in_group(user_id, context):
     if not ENABLE_GROUP_VERIFY:
         return True
         
-    try:
-        # 当 WHITELIST_GROUP_ID 为具体群组 ID 且开启进群验证时，检查用户是否在群组中
-        member = await context.bot.get_chat_member(WHITELIST_GROUP_ID, user_id)
-        return member.status in ["member", "administrator", "creator"]
-    except Exception as e:
-        print(f"Error checking if user {user_id} is in group: {e}")
-        return False
+    # 当 WHITELIST_GROUP_ID 为具体群组 ID 且开启进群验证时，检查用户是否在群组中（结果带缓存）
+    return await membership_cache.get(user_id, lambda: fetch_group_membership(user_id, context))
 
 # 添加切换进群验证的命令处理函数
 async def toggle_group_verify(update, context):
@@ -79,7 +230,9 @@ async def toggle_group_verify(update, context):
     global ENABLE_GROUP_VERIFY
     ENABLE_GROUP_VERIFY = context.args[0].lower() == "on"
     status_text = "开启" if ENABLE_GROUP_VERIFY else "关闭"
-    await update.message.reply_text(f"进群验证已{status_text}。")
+    stats = membership_cache.stats()
+    membership_cache.clear()
+    await update.message.reply_text(f"进群验证已{status_text}。\n{stats}")
 
 # 白名单模式状态文件加载与保存
 def load_whitelist_status():
@@ -99,23 +252,86 @@ def save_whitelist_status(status):
     # 将状态保存到文件
     with open(WHITELIST_STATUS_FILE, "w") as f:
         json.dump({"whitelist_enabled": status}, f)
+    _whitelist_mtimes[WHITELIST_STATUS_FILE] = file_mtime(WHITELIST_STATUS_FILE)
 
 def is_whitelist_enabled():
     # 返回白名单启用状态
-    return load_whitelist_status()
+    return whitelist_enabled
+
+
+# 常驻内存的用户数据：启动时加载一次，修改后延迟批量写盘
+class UserDataStore:
+    def __init__(self, path, flush_delay):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.data = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.data = json.load(f)
+        self.dirty = False
+        self._flush_task = None
+        self._write_lock = None
+
+    def save(self):
+        """标记数据已修改，flush_delay 秒内的多次修改合并为一次写盘"""
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(json.dumps(self.data, indent=4))
+            self.dirty = False
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # 写盘期间发生的修改不会再调度新的任务（本任务尚未结束），由这里继续写入
+        while self.dirty:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            if not self.dirty:
+                return
+            # 在事件循环中序列化，得到与所有已完成修改一致的快照
+            content = json.dumps(self.data, indent=4)
+            self.dirty = False
+            try:
+                await asyncio.to_thread(self._write, content)
+            except OSError as e:
+                self.dirty = True
+                print(f"Failed to save user data: {e}")
+
+    def _write(self, content):
+        # 先写临时文件再原子替换，避免写到一半时崩溃损坏数据
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
 
+user_store = None
 
-# 加载用户数据
+
+def get_user_store():
+    global user_store
+    if user_store is None:
+        user_store = UserDataStore(USER_DATA_FILE, USER_DATA_FLUSH_DELAY)
+    return user_store
+
+
+# 加载用户数据（返回常驻内存的数据，直接修改后调用 save_user_data）
 def load_user_data():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, "r") as f:
-            return json.load(f)
-    return {}
+    return get_user_store().data
 
 
 def save_user_data(user_data):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(user_data, f, indent=4)
+    get_user_store().save()
 
 
 # 用户注册
@@ -139,6 +355,15 @@ async def start(update, context):
         await update.message.reply_text("您已注册！可以继续添加或管理 RSS 源和相关规则。使用 /help 获取帮助。")
 
 
+# 能被 httpx 解析、且为 http(s) 的完整地址
+def is_valid_feed_url(rss_url):
+    try:
+        url = httpx.URL(rss_url)
+    except httpx.InvalidURL:
+        return False
+    return url.scheme in ("http", "https") and bool(url.host)
+
+
 # 添加 RSS 订阅源
 async def add_rss(update, context):
     user_id = update.effective_user.id
@@ -160,6 +385,9 @@ async def add_rss(update, context):
         return
 
     rss_url = context.args[0].lower()
+    if not is_valid_feed_url(rss_url):
+        await update.message.reply_text("无效的 RSS URL，请提供以 http:// 或 https:// 开头的完整地址，例如：/add_rss https://rss.nodeseek.com")
+        return
     for index, rss in enumerate(user_data[chat_id].get("rss_sources", [])):
         if rss["url"] == rss_url:
             existing_sources = "\n".join(
@@ -173,6 +401,7 @@ async def add_rss(update, context):
     rss_data = {"url": rss_url, "keywords": [], "regex_patterns": [], "regex_keywords": []}
     user_data[chat_id]["rss_sources"].append(rss_data)
     save_user_data(user_data)
+    forget_validators(rss_url)
 
     existing_sources = "\n".join(
         f"{i + 1}、{r['url']}" for i, r in enumerate(user_data[chat_id]["rss_sources"])
@@ -254,6 +483,28 @@ def validate_regex(pattern):
     except re.error as e:
         return False, str(e)
 
+def parse_keyword_rule(pattern_str):
+    """
+    把 +A+B-C 语法拆成 (必须包含的词列表, 不能包含的词列表)
+    与 create_regex_pattern 的解析规则保持一致
+    """
+    positive_terms = []
+    negative_terms = []
+
+    for part in pattern_str.split("+"):
+        if not part:
+            continue
+        if "-" in part:
+            neg_parts = part.split("-")
+            if neg_parts[0]:  # 如果有正向匹配部分
+                positive_terms.append(neg_parts[0])
+            negative_terms.extend(neg_part for neg_part in neg_parts[1:] if neg_part)
+        else:
+            positive_terms.append(part)
+
+    return positive_terms, negative_terms
+
+
 def create_regex_pattern(pattern_str):
     """
     创建正则表达式模式
@@ -264,25 +515,12 @@ def create_regex_pattern(pattern_str):
         return f".*{re.escape(pattern_str)}.*"
 
     # 处理复杂模式 +A+B-C
-    parts = pattern_str.split("+")
-    positive_patterns = []
-    negative_patterns = []
-
-    for part in parts:
-        if not part:
-            continue
-        if "-" in part:
-            neg_parts = part.split("-")
-            if neg_parts[0]:  # 如果有正向匹配部分
-                positive_patterns.append(f"(?=.*{re.escape(neg_parts[0])})")
-            for neg_part in neg_parts[1:]:
-                if neg_part:
-                    negative_patterns.append(f"(?!.*{re.escape(neg_part)})")
-        else:
-            positive_patterns.append(f"(?=.*{re.escape(part)})")
+    positive_terms, negative_terms = parse_keyword_rule(pattern_str)
+    positive_patterns = [f"(?=.*{re.escape(term)})" for term in positive_terms]
+    negative_patterns = [f"(?!.*{re.escape(term)})" for term in negative_terms]
 
     return "^" + "".join(negative_patterns + positive_patterns) + ".*$"
-    
+
 # 添加关键词到特定 RSS 源
 async def add(update, context):
     user_id = update.effective_user.id
@@ -329,6 +567,8 @@ async def add(update, context):
     if "regex_keywords" not in user_data[chat_id]["rss_sources"][rss_index]:
         user_data[chat_id]["rss_sources"][rss_index]["regex_keywords"] = []
 
+    invalidate_rules(user_data[chat_id]["rss_sources"][rss_index])
+
     # 判断是否是正则表达式模式
     if context.args[1].lower() == 'regex':
         # 正则表达式模式
@@ -347,6 +587,7 @@ async def add(update, context):
         # 添加正则表达式
         user_data[chat_id]["rss_sources"][rss_index]["regex_keywords"].append(regex_pattern)
         save_user_data(user_data)
+        forget_validators(user_data[chat_id]["rss_sources"][rss_index]["url"])
 
         # 显示结果
         regex_keywords = user_data[chat_id]["rss_sources"][rss_index]["regex_keywords"]
@@ -371,6 +612,7 @@ async def add(update, context):
                 added_keywords.append(pattern)
 
         save_user_data(user_data)
+        forget_validators(user_data[chat_id]["rss_sources"][rss_index]["url"])
 
         # 显示结果
         keywords = user_data[chat_id]["rss_sources"][rss_index]["keywords"]
@@ -418,6 +660,7 @@ async def rm(update, context):
         return
 
     rss_source = user_data[chat_id]["rss_sources"][rss_index]
+    invalidate_rules(rss_source)
 
     # 判断是否删除正则表达式
     if len(context.args) >= 3 and context.args[1].lower() == 'regex':
@@ -537,139 +780,1564 @@ async def rm_rss(update, context):
 
     removed_rss = user_data[chat_id]["rss_sources"].pop(rss_index)
     save_user_data(user_data)
+    invalidate_rules(removed_rss)
 
     await update.message.reply_text(f"RSS 源已删除：{removed_rss['url']}")
 
-# 检查 RSS 并推送新内容
-async def check_new_posts(context):
-    print("Fetching RSS data...")
-    cached_guids = load_cache()
-    user_data = load_user_data()
+# 共享的异步 HTTP 客户端（长连接复用）
+_http_client = None
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-        "Accept": "application/rss+xml, application/xml, text/xml",
-        "Referer": "https://www.google.com",
-        "Accept-Language": "en-US,en;q=0.9",
-    }
 
-    for chat_id, data in user_data.items():
-        rss_sources = data.get("rss_sources", [])
-        for rss in rss_sources:
-            rss_url = rss["url"]
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            headers=FETCH_HEADERS,
+            timeout=httpx.Timeout(FETCH_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=FETCH_CONCURRENCY,
+                max_keepalive_connections=FETCH_CONCURRENCY,
+            ),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# 条件请求校验信息：{url: {"etag", "last_modified", "length"}}
+_validators = None
+_validators_dirty = False
+
+# 条件请求统计：命中 304 的次数（即省下的解析次数）与省下的流量字节数
+fetch_stats = {"not_modified": 0, "bytes_saved": 0}
+
+
+def load_validators():
+    global _validators
+    if _validators is None:
+        _validators = {}
+        if os.path.exists(VALIDATORS_FILE):
+            with open(VALIDATORS_FILE, "r") as f:
+                try:
+                    _validators = json.load(f)
+                except json.JSONDecodeError:
+                    pass
+    return _validators
+
+
+def save_validators():
+    global _validators_dirty
+    if not _validators_dirty:
+        return
+    with open(VALIDATORS_FILE, "w") as f:
+        json.dump(_validators, f)
+    _validators_dirty = False
+
+
+# 订阅者或规则变化时丢弃校验信息，下一轮强制完整抓取
+def forget_validators(rss_url):
+    global _validators_dirty
+    if load_validators().pop(rss_url, None) is not None:
+        _validators_dirty = True
+
+
+def update_validators(rss_url, response, length):
+    global _validators_dirty
+    validators = load_validators()
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        if validators.pop(rss_url, None) is not None:
+            _validators_dirty = True
+        return
+
+    record = {"etag": etag, "last_modified": last_modified, "length": length}
+    if validators.get(rss_url) != record:
+        validators[rss_url] = record
+        _validators_dirty = True
+
+
+# 内容未变化 (304) 时 fetch_feed 返回的标记
+NOT_MODIFIED = object()
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+RDF_ABOUT = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+
 
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# Bark/bark_mix.py 中有一份对应的实现（local_name、_base、_entry 等）；Bark 按单个文件部署，不能引用本模块，修改时两处需同步
+class FeedStreamReader:
+    """
+    流式读取 RSS/Atom/JSON Feed：XML 按块喂入增量解析器，每个条目只保留标题、链接和 ID
+    超过大小上限或连续遇到已处理的条目后停止读取；格式异常的内容保留原始数据交给 feedparser
+    fast 为 False 时不做快速解析，只按大小上限读取，全部交给 feedparser
+    """
+
+    def __init__(self, max_bytes, is_done=None, stop_after=0, fast=True):
+        self.max_bytes = max_bytes
+        self.is_done = is_done  # guid -> 是否所有订阅者都已处理过
+        self.stop_after = stop_after
+        self.parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self.path = []
+        self.bases = []  # 与 path 对应的 xml:base，链接和 ID 按它解析为绝对地址
+        self.root = None
+        self.chunks = []  # 原始数据，仅在回退到 feedparser 时使用
+        self.size = 0
+        self.entries = []
+        self.ttl = None
+        self.done_streak = 0
+        self.truncated = False  # 超出大小上限
+        self.stopped = False  # 遇到已处理条目，提前停止
+        self.is_json = False
+        self.sniffed = False  # 是否已根据首个非空白字符判断格式
+        self.failed = not fast  # 需要回退到 feedparser
+
+    # 喂入一块数据，返回 False 表示无需继续读取
+    def feed(self, data):
+        if self.size + len(data) > self.max_bytes:
+            data = data[:self.max_bytes - self.size]
+            self.truncated = True
+        self.size += len(data)
+        self.chunks.append(data)
+        if not self.sniffed:
+            head = b"".join(self.chunks).lstrip(b"\xef\xbb\xbf \t\r\n")
+            if head:
+                self.sniffed = True
+                self.is_json = head.startswith(b"{")
+        if not self.failed and not self.is_json:
+            try:
+                self.parser.feed(data)
+                self._drain()
+            except ElementTree.ParseError:
+                self.failed = True
+        return not (self.truncated or self.stopped)
+
+    # 数据读取完毕
+    def close(self):
+        if self.is_json:
+            if not self.failed:
+                self._parse_json()
+            return
+        if not self.failed and not (self.truncated or self.stopped):
             try:
-                print(f"Fetching RSS: {rss_url}")
-                response = requests.get(rss_url, headers=headers, timeout=10)
-                response.raise_for_status()
-                feed = feedparser.parse(response.content)
-            except requests.RequestException as e:
-                print(f"Failed to fetch RSS: {rss_url}. Error: {e}")
+                self.parser.close()
+                self._drain()
+            except ElementTree.ParseError:
+                self.failed = True
+        if self.root not in ("rss", "feed", "RDF"):
+            self.failed = True
+
+    # 按 JSON Feed 规范提取 id、url、title
+    def _parse_json(self):
+        try:
+            items = json.loads(b"".join(self.chunks))["items"]
+        except (ValueError, KeyError, TypeError):
+            self.failed = True
+            return
+        if not isinstance(items, list):
+            self.failed = True
+            return
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            entry = feedparser.FeedParserDict()
+            if item.get("id") is not None:
+                entry["id"] = str(item["id"])
+            link = item.get("url") or item.get("external_url")
+            if link:
+                entry["link"] = link
+            elif "id" in entry:
+                entry["link"] = entry["id"]
+            else:
+                continue
+            entry["title"] = (item.get("title") or "").strip()
+            self.entries.append(entry)
+
+    def _drain(self):
+        for event, elem in self.parser.read_events():
+            tag = local_name(elem.tag)
+            if event == "start":
+                if self.root is None:
+                    self.root = tag
+                self.path.append(tag)
+                base = self._base(self.bases[-1] if self.bases else "", elem)
+                if base is None:
+                    self.failed = True
+                    return
+                self.bases.append(base)
                 continue
 
+            self.path.pop()
+            base = self.bases.pop()
+            if tag in ("item", "entry"):
+                entry = self._entry(elem, base)
+                elem.clear()
+                if entry is None:
+                    self.failed = True
+                    return
+                self.entries.append(entry)
+                guid = entry.id if "id" in entry else entry.link
+                if self.is_done is not None and self.is_done(guid):
+                    self.done_streak += 1
+                    if self.stop_after and self.done_streak >= self.stop_after:
+                        self.stopped = True
+                        return
+                else:
+                    self.done_streak = 0
+            elif tag == "ttl" and self.path and self.path[-1] == "channel":
+                self.ttl = (elem.text or "").strip()
+
+    # 元素的 xml:base 与上层的合并；得到相对地址时返回 None，交给 feedparser 按它的规则处理
+    @staticmethod
+    def _base(parent, elem):
+        value = elem.get(XML_BASE)
+        if value is None:
+            return parent
+        base = urljoin(parent, value.strip())
+        return base if urlparse(base).scheme else None
+
+    # 提取标题、链接和 ID，与 feedparser 的结果保持一致；遇到需要完整解析的结构时返回 None
+    # 与 feedparser 相同，链接、Atom id 与作为永久链接的 guid 按 xml:base 解析，rdf:about 保持原样
+    def _entry(self, elem, base):
+        entry = feedparser.FeedParserDict()
+        permalink = True
+        for child in elem:
+            tag = local_name(child.tag)
+            child_base = self._base(base, child)
+            if child_base is None:
+                return None
+            if tag == "title" and "title" not in entry:
+                if child.get("type") == "xhtml":
+                    return None
+                entry["title"] = "".join(child.itertext()).strip()
+            elif tag == "link" and "link" not in entry:
+                href = child.get("href")
+                if href is None:
+                    if (child.text or "").strip():
+                        entry["link"] = urljoin(child_base, child.text.strip())
+                elif child.get("rel", "alternate") == "alternate":
+                    entry["link"] = urljoin(child_base, href.strip())
+            elif tag in ("guid", "id") and "id" not in entry and (child.text or "").strip():
+                permalink = child.get("isPermaLink", "true") != "false"
+                entry["id"] = urljoin(child_base, child.text.strip()) if permalink else child.text.strip()
+
+        if "id" not in entry and elem.get(RDF_ABOUT):
+            entry["id"] = elem.get(RDF_ABOUT)
+        if "link" not in entry and "id" in entry and permalink:
+            entry["link"] = entry["id"]
+        if "link" not in entry and "id" not in entry:
+            return None
+        entry.setdefault("title", "")
+        return entry
+
+    def result(self):
+        feed = feedparser.FeedParserDict()
+        if self.ttl:
+            feed["ttl"] = self.ttl
+        return feedparser.FeedParserDict(
+            feed=feed, entries=self.entries, partial=self.truncated or self.stopped
+        )
+
+
+# 以流式方式读取响应，返回 NOT_MODIFIED 或 (response, reader)
+async def stream_feed(rss_url, headers, is_done, raw):
+    async with get_http_client().stream("GET", rss_url, headers=headers) as response:
+        get_feed_scheduler().note_response(rss_url, response)
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        response.raise_for_status()
+
+        reader = FeedStreamReader(MAX_FEED_BYTES, is_done, EARLY_STOP_SEEN, FAST_PARSER and not raw)
+        # aiter_bytes 按块解压，内存占用不随响应体大小增长
+        async for chunk in response.aiter_bytes():
+            if not reader.feed(chunk):
+                break
+        reader.close()
+    return response, reader
+
+
+# 抓取并解析单个 RSS 源，失败时返回 None，内容未变化时返回 NOT_MODIFIED
+# is_done(guid) 判断条目是否已被所有订阅者处理，用于在读到旧条目后提前停止
+# raw 为 True 时不解析，返回 (原始数据, 是否被截断)，交给工作进程处理
+async def fetch_feed(rss_url, semaphore, is_done=None, raw=False):
+    cached = load_validators().get(rss_url, {})
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    async with semaphore:
+        try:
+            print(f"Fetching RSS: {rss_url}")
+            # 整体时间上限，避免个别源持续缓慢输出而拖住整轮抓取
+            result = await asyncio.wait_for(stream_feed(rss_url, headers, is_done, raw), FEED_TIME_BUDGET)
+        except httpx.HTTPError as e:
+            print(f"Failed to fetch RSS: {rss_url}. Error: {e}")
+            return None
+        except asyncio.TimeoutError:
+            print(f"Failed to fetch RSS: {rss_url}. Error: exceeded {FEED_TIME_BUDGET}s budget")
+            return None
+        except Exception as e:
+            # 如无效 URL (httpx.InvalidURL 不是 HTTPError 的子类)；单个源出错不能中断整批的调度
+            print(f"Failed to fetch RSS: {rss_url}. Error: {e!r}")
+            return None
+
+    if result is NOT_MODIFIED:
+        fetch_stats["not_modified"] += 1
+        fetch_stats["bytes_saved"] += cached.get("length", 0)
+        print(f"RSS not modified: {rss_url}")
+        return NOT_MODIFIED
+
+    response, reader = result
+    update_validators(rss_url, response, reader.size)
+    if reader.truncated:
+        print(f"RSS body exceeds {MAX_FEED_BYTES} bytes, truncated: {rss_url}")
+
+    if raw:
+        return b"".join(reader.chunks), reader.truncated
+    if not reader.failed:
+        return reader.result()
+
+    # 非标准内容交给 feedparser；它是同步解析，放到线程中执行以免阻塞事件循环
+    feed = await asyncio.to_thread(feedparser.parse, b"".join(reader.chunks))
+    feed["partial"] = reader.truncated
+    return feed
+
+
+# ---------------- 抓取调度 ----------------
+# Bark/bark_mix.py 中有一份对应的 parse_retry_after、parse_max_age 与 FeedScheduler；Bark 按单个文件部署，不能引用本模块，修改时两处需同步
+# 解析 Retry-After（秒数或 HTTP 日期），返回需要等待的秒数
+def parse_retry_after(value):
+    if not value:
+        return 0
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
+
+
+# 解析 Cache-Control 中的 max-age(秒)
+def parse_max_age(value):
+    match = re.search(r"max-age\s*=\s*(\d+)", value or "")
+    return int(match.group(1)) if match else 0
+
+
+class FeedScheduler:
+    """
+    按源调度抓取：每个源有自己的下次抓取时间，保存在最小堆中
+    间隔按观测到的新条目速率自适应调整，遵守源的 <ttl>、Cache-Control 与 Retry-After，
+    并加入随机抖动，避免所有源在同一时刻集中抓取
+    """
+
+    def __init__(self, base_interval, min_interval, max_interval, jitter=0.1):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.jitter = jitter
+        self.heap = []  # (到期时间, url)，重新调度后旧的堆项按 next_due 判断为过期
+        self.next_due = {}  # url -> 到期时间，已取出待抓取的源不在其中
+        self.intervals = {}  # url -> 当前抓取间隔(秒)
+        self.post_rates = {}  # url -> 新条目速率的指数滑动平均(条/秒)
+        self.last_fetch = {}  # url -> 上次抓取完成时间
+        self.hints = {}  # url -> 服务器要求的最短等待时间(秒)
+        self.retry_after = {}  # url -> Retry-After 要求的等待时间(秒)
+
+    def _push(self, url, due):
+        self.next_due[url] = due
+        heapq.heappush(self.heap, (due, url))
+
+    # 与当前订阅的源同步：新源（以及取出后未重新调度的源）立即到期，已无人订阅的源丢弃
+    def sync(self, urls):
+        now = time.time()
+        for url in urls:
+            if url not in self.next_due:
+                self._push(url, now)
+        for url in list(self.next_due):
+            if url not in urls:
+                self.forget(url)
+
+    def forget(self, url):
+        for state in (self.next_due, self.intervals, self.post_rates,
+                      self.last_fetch, self.hints, self.retry_after):
+            state.pop(url, None)
+
+    # 按到期先后取出已到期的源，最多 limit 个
+    def pop_due(self, now=None, limit=None):
+        now = time.time() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now and (limit is None or len(due) < limit):
+            due_at, url = heapq.heappop(self.heap)
+            if self.next_due.get(url) != due_at:
+                continue
+            del self.next_due[url]
+            due.append(url)
+        return due
+
+    # 记录响应头中的调度提示
+    def note_response(self, url, response):
+        self.hints[url] = parse_max_age(response.headers.get("Cache-Control"))
+        if response.status_code in (429, 503):
+            self.retry_after[url] = parse_retry_after(response.headers.get("Retry-After"))
+
+    # 记录源自身声明的 <ttl>(分钟)
+    def note_feed(self, url, feed):
+        try:
+            ttl = int(feed.feed.get("ttl", 0)) * 60
+        except (TypeError, ValueError):
+            ttl = 0
+        self.hints[url] = max(self.hints.get(url, 0), ttl)
+
+    # 抓取结束后安排下次抓取；new_entries 为 None 表示抓取失败
+    def reschedule(self, url, new_entries):
+        now = time.time()
+        interval = self.intervals.get(url, self.base_interval)
+        last_fetch = self.last_fetch.get(url)
+
+        if new_entries is None:
+            # 失败时指数退避
+            interval = min(self.max_interval, interval * 2)
+        else:
+            self.last_fetch[url] = now
+            # 首次抓取的条目都是新的，不代表发帖速率
+            if last_fetch is not None:
+                observed = new_entries / max(now - last_fetch, 1)
+                rate = 0.3 * observed + 0.7 * self.post_rates.get(url, observed)
+                self.post_rates[url] = rate
+                # 目标是平均每次抓取约有一条新条目
+                interval = 1 / rate if rate > 0 else interval * 1.5
+                interval = min(self.max_interval, max(self.min_interval, interval))
+        self.intervals[url] = interval
+
+        delay = max(interval, min(self.hints.pop(url, 0), self.max_interval))
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        # Retry-After 是服务器的明确要求，不受最长间隔限制
+        delay = max(delay, self.retry_after.pop(url, 0))
+        self._push(url, now + delay)
+
+    # 已到期但尚未抓取的源数量
+    def due_count(self, now=None):
+        now = time.time() if now is None else now
+        return sum(1 for due_at in self.next_due.values() if due_at <= now)
+
+    # 下一个源的到期时间，没有源时返回 None
+    def next_wakeup(self):
+        while self.heap and self.next_due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+
+feed_scheduler = None
+
+
+def get_feed_scheduler():
+    global feed_scheduler
+    if feed_scheduler is None:
+        feed_scheduler = FeedScheduler(UPDATE_INTERVAL, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL)
+    return feed_scheduler
+
+
+# ---------------- 规则引擎 ----------------
+# 已编译规则缓存：规则集哈希 -> CompiledRules，只在 /add、/rm、/rm_rss 修改规则时失效
+_rule_cache = {}
+
+
+def rules_key(rss):
+    """根据订阅源的关键词与正则生成稳定的规则集哈希"""
+    rule_set = [rss.get("keywords", []), rss.get("regex_patterns", []), rss.get("regex_keywords", [])]
+    return hashlib.sha1(json.dumps(rule_set, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def compile_rule(pattern):
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        print(f"Regex error: {e} for pattern: {pattern}")
+        return None
+
+
+# re.IGNORECASE 额外视为相同的小写字符（如 ı/i、ſ/s），统一映射到同一字符
+_CASE_FOLD = {
+    char: min(char, *equivalents)
+    for char, equivalents in _RE_EXTRA_CASES.items()
+    if min(char, *equivalents) != char
+}
+
+
+# Bark/bark_mix.py 中有一份对应的大小写归一（那里的 fold_case 自己先做 lower()）；Bark 按单个文件部署，不能引用本模块，修改时两处需同步
+def fold_case(text):
+    """对已 lower() 的文本做大小写归一，子串匹配结果与 re.IGNORECASE 一致"""
+    return text.translate(_CASE_FOLD)
+
+
+def keyword_terms(keyword, pattern):
+    """
+    把由 create_regex_pattern 生成的关键词规则转换为 (包含词, 排除词) 的词集合（均已归一）
+    手工修改过或旧版本生成的 regex_patterns 返回 None，继续按正则匹配
+    """
+    if not keyword or keyword != keyword.lower() or pattern != create_regex_pattern(keyword):
+        return None
+    positive_terms, negative_terms = parse_keyword_rule(keyword)
+    if not any(c in keyword for c in "+-"):
+        positive_terms = [keyword]
+    return tuple(map(fold_case, positive_terms)), tuple(map(fold_case, negative_terms))
+
+
+class CompiledRules:
+    """单个订阅源已编译好的规则，匹配时不再编译任何正则"""
+
+    def __init__(self, keywords, regex_patterns, regex_keywords):
+        # 普通关键词（含 +A+B-C 语法）的规则，与 keywords 按下标对应
+        # 每项为 (关键词, 已编译正则, 词集合或 None, 是否为复杂规则)
+        self.keyword_rules = []
+        for i, pattern in enumerate(regex_patterns):
+            compiled = compile_rule(pattern)
+            if compiled is not None:
+                keyword = keywords[i] if i < len(keywords) else None
+                terms = keyword_terms(keyword, pattern)
+                is_complex = terms is not None and any(c in keyword for c in "+-")
+                self.keyword_rules.append((keyword, compiled, terms, is_complex))
+
+        # 用户直接添加的正则表达式
+        self.regex_rules = []
+        for pattern in regex_keywords:
+            compiled = compile_rule(pattern)
+            if compiled is not None:
+                self.regex_rules.append((pattern, compiled))
+
+        # 词集合规则交给 KeywordAutomaton 统一匹配，其余规则仍需逐条执行正则
+        self.needs_regex = bool(self.regex_rules) or any(terms is None for _, _, terms, _ in self.keyword_rules)
+        self.has_complex = any(is_complex for _, _, _, is_complex in self.keyword_rules)
+
+    def match(self, raw_title, term_hit=None, multiline=False):
+        """
+        返回 (规则类型, 匹配到的规则) 或 None
+        term_hit 为按词集合匹配得到的、最靠前命中的规则下标，这些规则不再逐条执行正则
+        复杂规则的正则带 ^...$ 且不跨行，标题含换行时改用正则判断以保持原有语义
+        """
+        for i, (keyword, compiled, terms, is_complex) in enumerate(self.keyword_rules):
+            if i == term_hit:
+                return "keyword", keyword
+            if terms is None or (is_complex and multiline):
+                if compiled.search(raw_title):
+                    return "keyword", keyword
+
+        # 如果还没有匹配，检查正则表达式关键词
+        for pattern, compiled in self.regex_rules:
+            if compiled.search(raw_title):
+                return "regex", pattern
+
+        return None
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 多模式匹配，一次扫描标题即可找出所有出现的关键词"""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+
+        for word_id, word in enumerate(words):
+            node = 0
+            for char in word:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                node = next_node
+            self.output[node] += (word_id,)
+
+        # 按层构建失败指针，并把失败链上的输出合并到当前节点
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                if node:
+                    fail = self.goto[fail].get(char, 0)
+                self.fail[next_node] = fail
+                self.output[next_node] += self.output[fail]
+
+    def search(self, text):
+        """返回 text 中出现过的所有关键词编号"""
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class FeedMatcher:
+    """
+    同一 URL 所有订阅者规则的合并匹配器
+    所有规则用到的词共用一个 KeywordAutomaton，每个标题只扫描一次，各规则共享词的查找结果
+    """
+
+    def __init__(self, subscribers):
+        self.subscribers = [(chat_id, get_compiled_rules(rss)) for chat_id, rss in subscribers]
+
+        term_ids = {}
+
+        def term_id(term):
+            return term_ids.setdefault(term, len(term_ids))
+
+        # 按第一个包含词索引规则，只有该词出现时才需要判断这条规则
+        # 每项为 (订阅者下标, 规则下标, 包含词编号, 排除词编号, 是否为复杂规则)
+        self.rules_by_term = {}
+        self.unconditional_rules = []  # 没有包含词的规则（如只有排除词）
+        for index, (_, rules) in enumerate(self.subscribers):
+            for rule_index, (_, _, terms, is_complex) in enumerate(rules.keyword_rules):
+                if terms is None:
+                    continue
+                include = tuple(term_id(term) for term in terms[0])
+                exclude = tuple(term_id(term) for term in terms[1])
+                rule = (index, rule_index, include, exclude, is_complex)
+                if include:
+                    self.rules_by_term.setdefault(include[0], []).append(rule)
+                else:
+                    self.unconditional_rules.append(rule)
+
+        self.automaton = KeywordAutomaton(list(term_ids))
+        self.regex_subscribers = [
+            index for index, (_, rules) in enumerate(self.subscribers) if rules.needs_regex
+        ]
+        self.complex_subscribers = [
+            index for index, (_, rules) in enumerate(self.subscribers) if rules.has_complex
+        ]
+
+    def match(self, raw_title):
+        """返回 [(chat_id, 规则类型, 匹配到的规则)]，每个订阅者最多一条"""
+        present = self.automaton.search(fold_case(raw_title))
+        multiline = "\n" in raw_title
+
+        term_hits = {}
+        rules_by_term = self.rules_by_term
+        candidates = [rules_by_term[term] for term in present if term in rules_by_term]
+        candidates.append(self.unconditional_rules)
+        for rules in candidates:
+            for index, rule_index, include, exclude, is_complex in rules:
+                if is_complex and multiline:
+                    continue
+                if index in term_hits and term_hits[index] <= rule_index:
+                    continue
+                if present.issuperset(include) and present.isdisjoint(exclude):
+                    term_hits[index] = rule_index
+
+        indexes = set(term_hits)
+        indexes.update(self.regex_subscribers)
+        if multiline:
+            indexes.update(self.complex_subscribers)
+
+        results = []
+        for index in sorted(indexes):
+            chat_id, rules = self.subscribers[index]
+            matched = rules.match(raw_title, term_hits.get(index), multiline)
+            if matched is not None:
+                results.append((chat_id, *matched))
+        return results
+
+    def match_entry(self, position, raw_title):
+        """与 PrecomputedMatches 相同的接口，position 为条目在源中的下标"""
+        return self.match(raw_title)
+
+
+# 每个 URL 的合并匹配器：url -> (订阅者规则集哈希, FeedMatcher)
+_feed_matchers = {}
+
+
+def get_feed_matcher(rss_url, subscribers):
+    key = tuple((chat_id, rules_key(rss)) for chat_id, rss in subscribers)
+    cached = _feed_matchers.get(rss_url)
+    if cached is None or cached[0] != key:
+        cached = (key, FeedMatcher(subscribers))
+        _feed_matchers[rss_url] = cached
+    return cached[1]
+
+
+def get_compiled_rules(rss):
+    key = rules_key(rss)
+    rules = _rule_cache.get(key)
+    if rules is None:
+        rules = CompiledRules(
+            rss.get("keywords", []),
+            rss.get("regex_patterns", []),
+            rss.get("regex_keywords", []),
+        )
+        _rule_cache[key] = rules
+    return rules
+
+
+# 规则即将被修改时调用，丢弃旧规则集的编译结果
+def invalidate_rules(rss):
+    _rule_cache.pop(rules_key(rss), None)
+
+
+# ---------------- 多进程解析与匹配 ----------------
+_worker_matchers = OrderedDict()  # 工作进程内：匹配器键 -> FeedMatcher
+WORKER_MATCHER_CACHE_SIZE = 256
+
+
+def parse_and_match(body, truncated, fast, matcher_key, rule_specs=None):
+    """
+    在工作进程中解析源并用该源所有订阅者的规则匹配标题，truncated 表示数据因超出大小上限而不完整
+    matcher_key 为 ((chat_id, 规则集哈希), ...)；rule_specs 为 {规则集哈希: (keywords, regex_patterns, regex_keywords)}，
+    工作进程已缓存该匹配器时可以省略。未缓存且没有 rule_specs 时返回 None，由调用方附带规则重新提交
+
+    返回 (ttl, 条目列表, 命中结果)：条目列表每项为 (id, link, title)，未命中的条目 title 为 None；
+    命中结果为 {条目下标: [(chat_id, kind, rule), ...]}，按下标而不是标题对应，未命中条目的 title 无法与空标题区分
+    """
+    matcher = _worker_matchers.get(matcher_key)
+    if matcher is None:
+        if rule_specs is None:
+            return None
+        subscribers = [
+            (chat_id, dict(zip(("keywords", "regex_patterns", "regex_keywords"), rule_specs[key])))
+            for chat_id, key in matcher_key
+        ]
+        matcher = FeedMatcher(subscribers)
+        _worker_matchers[matcher_key] = matcher
+        if len(_worker_matchers) > WORKER_MATCHER_CACHE_SIZE:
+            _worker_matchers.popitem(last=False)
+    else:
+        _worker_matchers.move_to_end(matcher_key)
+
+    reader = FeedStreamReader(len(body), fast=fast)
+    reader.feed(body)
+    # 不完整的数据只保留已读完的条目，与主进程中的处理一致
+    reader.truncated = truncated
+    reader.close()
+    feed = feedparser.parse(body) if reader.failed else reader.result()
+
+    entries = []
+    hits = {}
+    matches_by_title = {}  # 相同标题只匹配一次
+    for position, entry in enumerate(feed.entries):
+        title = entry.get("title", "")
+        raw_title = title.lower()
+        if raw_title not in matches_by_title:
+            matches_by_title[raw_title] = matcher.match(raw_title)
+        matches = matches_by_title[raw_title]
+        if matches:
+            hits[position] = matches
+        entries.append((entry.get("id"), entry.get("link"), title if matches else None))
+    return feed.feed.get("ttl"), entries, hits
+
+
+class PrecomputedMatches:
+    """工作进程返回的匹配结果，match_entry 接口与 FeedMatcher 相同"""
+
+    def __init__(self, subscribers, hits):
+        self.subscribers = [(chat_id, None) for chat_id, _ in subscribers]
+        self.hits = hits
+
+    def match_entry(self, position, raw_title):
+        return self.hits.get(position, [])
+
+
+parse_pool = None
+
+
+def get_parse_pool():
+    global parse_pool
+    if parse_pool is None:
+        # spawn 启动的进程不继承事件循环、HTTP 连接和数据库连接
+        parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return parse_pool
+
+
+# 把抓取到的原始数据交给工作进程解析与匹配，返回 (feed, matcher)，失败时 feed 为 None
+async def parse_in_pool(rss_url, fetched, subscribers):
+    body, truncated = fetched
+    matcher_key = tuple((chat_id, rules_key(rss)) for chat_id, rss in subscribers)
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    try:
+        result = await loop.run_in_executor(pool, parse_and_match, body, truncated, FAST_PARSER, matcher_key)
+        if result is None:
+            rule_specs = {
+                rules_key(rss): (rss.get("keywords", []), rss.get("regex_patterns", []), rss.get("regex_keywords", []))
+                for _, rss in subscribers
+            }
+            result = await loop.run_in_executor(
+                pool, parse_and_match, body, truncated, FAST_PARSER, matcher_key, rule_specs
+            )
+    except Exception as e:
+        print(f"Failed to parse RSS in worker: {rss_url}. Error: {e}")
+        # 抓取时已保存了新的 ETag/Last-Modified，丢弃它，否则重试会得到 304 而漏掉这一版的条目
+        forget_validators(rss_url)
+        return None, None
+
+    ttl, entries, hits = result
+    feed_entries = []
+    for entry_id, link, title in entries:
+        entry = feedparser.FeedParserDict(title=title or "")
+        if entry_id is not None:
+            entry["id"] = entry_id
+        if link is not None:
+            entry["link"] = link
+        feed_entries.append(entry)
+    feed = feedparser.FeedParserDict(
+        feed=feedparser.FeedParserDict(ttl=ttl) if ttl else feedparser.FeedParserDict(),
+        entries=feed_entries,
+        partial=truncated,
+    )
+    return feed, PrecomputedMatches(subscribers, hits)
+
+
+# 生成推送消息
+def format_message(entry, rss_url, kind, rule):
+    title = escape_markdown(entry.title, version=2)
+    link = escape_markdown(entry.link, version=2)
+
+    # 获取RSS源的简短名称
+    source_name = rss_url.replace('https://', '').replace('http://', '').split('/')[0]
+    current_time = datetime.now().strftime('%H:%M:%S')
+
+    if kind == "keyword":
+        # 关键词匹配的消息格式
+        icon = "🎯"
+        display_rule = rule or '未知'
+    else:
+        # 正则匹配的消息格式
+        # 如果正则表达式太长，截断显示
+        icon = "🔍"
+        display_rule = rule if len(rule) <= 30 else rule[:27] + "..."
+
+    return (
+        f"{icon} *RSS捕获到目标啦*\n"
+        f"{'─' * 15}\n"
+        f"📰 *{title}*\n\n"
+        f"匹配规则：`{escape_markdown(display_rule, version=2)}`\n"
+        f"🌐 {escape_markdown(source_name, version=2)}\n"
+        f"🕐 {current_time}\n\n"
+        f"[🔗 查看全文]({link})"
+    )
+
+
+# 构建 URL -> 订阅者 索引，同一 URL 每轮只抓取一次
+def build_subscription_index(user_data):
+    index = {}
+    for chat_id, data in user_data.items():
+        for rss in data.get("rss_sources", []):
+            index.setdefault(rss["url"], []).append((chat_id, rss))
+    return index
+
+
+# 检查 RSS 并推送新内容
+class SweepCoordinator:
+    """
+    协调定时抓取任务：上一轮未结束时跳过本次触发，避免两轮抓取重叠；
+    每轮按到期先后分批处理，超过时间片后剩余的源留在堆中，下一轮从这里继续
+    """
+
+    def __init__(self, batch_size, time_budget):
+        self.batch_size = max(1, batch_size)
+        self.time_budget = time_budget
+        self.running = False
+        self.skipped = 0  # 因上一轮未结束而跳过的触发次数
+        self.last_duration = 0.0
+        self.last_backlog = 0
+
+    async def run(self, context):
+        if self.running:
+            self.skipped += 1
+            return
+        self.running = True
+        try:
+            await self._sweep(context)
+        finally:
+            self.running = False
+
+    async def _sweep(self, context):
+        scheduler = get_feed_scheduler()
+        index = build_subscription_index(load_user_data())
+        scheduler.sync(index)
+        if not scheduler.due_count():
+            return
+
+        started = time.monotonic()
+        processed = 0
+        print(f"Fetching RSS data... ({scheduler.due_count()}/{len(index)} feeds due)")
+
+        # 补发上次重试耗尽而仍留在发件箱中的消息
+        get_delivery_queue(context.bot).requeue_pending()
+
+        while time.monotonic() - started < self.time_budget:
+            due_urls = scheduler.pop_due(limit=self.batch_size)
+            if not due_urls:
+                break
+            await sweep_batch(context, due_urls, index)
+            processed += len(due_urls)
+
+        get_seen_store().maybe_compact()
+        get_outbox().maybe_compact()
+        save_validators()
+
+        self.last_duration = time.monotonic() - started
+        self.last_backlog = scheduler.due_count()
+        print(
+            f"Sweep finished in {self.last_duration:.1f}s: {processed} feeds fetched, "
+            f"{self.last_backlog} due feeds left for the next tick, {self.skipped} overlapping ticks skipped"
+        )
+        if delivery_queue is not None:
+            print(f"Delivery backlog: {delivery_queue.backlog()} messages")
+        print(
+            f"Conditional GET: {fetch_stats['not_modified']} parses skipped, "
+            f"{fetch_stats['bytes_saved']} bytes saved"
+        )
+
+
+sweep_coordinator = None
+
+
+def get_sweep_coordinator():
+    global sweep_coordinator
+    if sweep_coordinator is None:
+        sweep_coordinator = SweepCoordinator(SWEEP_BATCH_SIZE, SWEEP_TIME_BUDGET)
+    return sweep_coordinator
+
+
+async def check_new_posts(context):
+    await get_sweep_coordinator().run(context)
+
+
+# 并发抓取一批到期的源并逐个匹配推送，之后按结果安排各源的下次抓取
+async def sweep_batch(context, due_urls, index):
+    scheduler = get_feed_scheduler()
+    seen = get_seen_store()
+    outbox = get_outbox()
+
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    offload = PARSE_WORKERS > 0
+    feeds = await asyncio.gather(
+        *(
+            fetch_feed(rss_url, semaphore, seen.watermark(rss_url, index[rss_url]), raw=offload)
+            for rss_url in due_urls
+        )
+    )
+
+    # 解析与匹配在工作进程中并行执行，主进程只做去重、记录与推送
+    matchers = [None] * len(due_urls)
+    if offload:
+        pending = [i for i, feed in enumerate(feeds) if isinstance(feed, tuple)]
+        results = await asyncio.gather(
+            *(parse_in_pool(due_urls[i], feeds[i], index[due_urls[i]]) for i in pending)
+        )
+        for i, (feed, matcher) in zip(pending, results):
+            feeds[i], matchers[i] = feed, matcher
+
+    for rss_url, feed, matcher in zip(due_urls, feeds, matchers):
+        new_entries = None
+        try:
+            if feed is None:
+                continue
+            if feed is NOT_MODIFIED:
+                new_entries = 0
+                continue
+
+            scheduler.note_feed(rss_url, feed)
             if not feed.entries:
                 print(f"No entries found in RSS feed: {rss_url}")
+                new_entries = 0
                 continue
 
-            for entry in feed.entries:
-                guid = entry.id if "id" in entry else entry.link
+            if matcher is None:
+                matcher = get_feed_matcher(rss_url, index[rss_url])
+
+            try:
+                new_entries = await process_feed_entries(
+                    context, rss_url, feed.entries, matcher, seen, feed.get("partial", False)
+                )
+            finally:
+                # 先让发件箱落盘，再标记条目为已处理，保证匹配结果不会丢失
+                outbox.sync()
+                seen.commit()
+        finally:
+            scheduler.reschedule(rss_url, new_entries)
+
+
+# 对一个源的条目做匹配与推送，按 (源, 订阅者) 去重，匹配与否都记录为已处理，返回新条目数
+# partial 表示只读取了源的前一部分（提前停止或超出大小上限）
+async def process_feed_entries(context, rss_url, entries, matcher, seen, partial=False):
+    delivery = get_delivery_queue(context.bot)
+    outbox = get_outbox()
+    chat_ids = [chat_id for chat_id, _ in matcher.subscribers]
+    cursors = {chat_id: seen.cursor(rss_url, chat_id) for chat_id in chat_ids}
+    min_cursor = min(cursors.values())
+    present_ids = []
+    new_entries = 0
+    # 新条目是否都排在已知条目之前：None 为无法判断，用于决定之后能否提前停止读取
+    newest_first = None
+    known_seen = False
 
-                if guid in cached_guids:
+    try:
+        for position, entry in enumerate(entries):
+            guid = entry.id if "id" in entry else entry.link
+
+            entry_id = seen.entry_id(rss_url, guid)
+            if entry_id is not None:
+                known_seen = True
+                present_ids.append(entry_id)
+                # 所有订阅者都已处理过该条目
+                if entry_id <= min_cursor:
                     continue
 
-                raw_title = entry.title.lower()
-                title = escape_markdown(entry.title, version=2)
-                link = escape_markdown(entry.link, version=2)
-                
-                # 获取RSS源的简短名称
-                source_name = rss_url.replace('https://', '').replace('http://', '').split('/')[0]
-                current_time = datetime.now().strftime('%H:%M:%S')
-
-                message_sent = False
-                matched_keyword = None
-
-                # 检查普通关键词匹配
-                keywords = rss.get("keywords", [])
-                regex_patterns = rss.get("regex_patterns", [])
-                
-                for i, pattern in enumerate(regex_patterns):
-                    try:
-                        if re.search(pattern, raw_title, re.IGNORECASE):
-                            # 获取对应的关键词
-                            if i < len(keywords):
-                                matched_keyword = keywords[i]
-                            
-                            # 关键词匹配的消息格式
-                            message_text = (
-                                f"🎯 *RSS捕获到目标啦*\n"
-                                f"{'─' * 15}\n"
-                                f"📰 *{title}*\n\n"
-                                f"匹配规则：`{escape_markdown(matched_keyword or '未知', version=2)}`\n"
-                                f"🌐 {escape_markdown(source_name, version=2)}\n"
-                                f"🕐 {current_time}\n\n"
-                                f"[🔗 查看全文]({link})"
-                            )
-                            
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=message_text,
-                                parse_mode="MarkdownV2",
-                            )
-                            print(f"Message sent to {chat_id}: {raw_title} (matched keyword: {matched_keyword})")
-
-                            cached_guids.add(guid)
-                            save_cache(cached_guids)
-                            message_sent = True
-                            break
-                    except re.error as e:
-                        print(f"Regex error: {e} for pattern: {pattern}")
-
-                # 如果还没有匹配，检查正则表达式关键词
-                if not message_sent:
-                    regex_keywords = rss.get("regex_keywords", [])
-                    for regex_pattern in regex_keywords:
-                        try:
-                            if re.search(regex_pattern, raw_title, re.IGNORECASE):
-                                # 正则匹配的消息格式
-                                # 如果正则表达式太长，截断显示
-                                display_pattern = regex_pattern
-                                if len(display_pattern) > 30:
-                                    display_pattern = display_pattern[:27] + "..."
-                                
-                                message_text = (
-                                    f"🔍 *RSS捕获到目标啦*\n"
-                                    f"{'─' * 15}\n"
-                                    f"📰 *{title}*\n\n"
-                                    f"匹配规则：`{escape_markdown(display_pattern, version=2)}`\n"
-                                    f"🌐 {escape_markdown(source_name, version=2)}\n"
-                                    f"🕐 {current_time}\n\n"
-                                    f"[🔗 查看全文]({link})"
-                                )
-                                
-                                await context.bot.send_message(
-                                    chat_id=chat_id,
-                                    text=message_text,
-                                    parse_mode="MarkdownV2",
-                                )
-                                print(f"Message sent to {chat_id}: {raw_title} (matched regex: {regex_pattern})")
-                                
-                                cached_guids.add(guid)
-                                save_cache(cached_guids)
-                                break
-                        except re.error as e:
-                            print(f"Regex error: {e} for pattern: {regex_pattern}")
-
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r") as f:
-            return set(line.strip() for line in f)
-    return set()
+            raw_title = entry.title.lower()
+            message_sent = False
+
+            # 一次扫描标题得到所有订阅者的匹配结果，推送交给队列，抓取与匹配不等待发送
+            for chat_id, kind, rule in matcher.match_entry(position, raw_title):
+                # 新订阅者补查旧条目时，跳过其他订阅者已处理过的部分
+                if entry_id is not None and entry_id <= cursors[chat_id]:
+                    continue
+                # 先写入发件箱，崩溃重启后由发件箱补发；已在发件箱中的 (聊天, 条目) 不重复推送
+                record = outbox.add(
+                    chat_id,
+                    f"{rss_url}\n{guid}",
+                    format_message(entry, rss_url, kind, rule),
+                    f"{raw_title} (matched {kind}: {rule})",
+                )
+                if record is not None:
+                    delivery.put(record)
+                message_sent = True
+
+            if entry_id is None:
+                present_ids.append(seen.add(rss_url, guid, message_sent))
+                new_entries += 1
+                if newest_first is not False:
+                    newest_first = not known_seen
+    finally:
+        seen.mark_present(rss_url, present_ids, partial)
+        seen.advance(rss_url, chat_ids)
+
+    if not known_seen:
+        newest_first = None
+    seen.record_order(rss_url, partial, newest_first)
+
+    return new_entries
+
+
+class SeenStore:
+    """
+    已处理条目存储：SQLite (WAL) 持久化，内存中按源保留 guid -> 条目编号 的索引
+    每条新条目只追加一行，定期按保留天数和每源数量上限清理
+
+    条目编号全局递增，每个 (源, 订阅者) 只记录一个游标：已处理到的最大条目编号。
+    编号不大于游标的条目即该订阅者已处理过，一次字典查找加一次比较即可判断。
+    编号使用 AUTOINCREMENT 分配，清理删除的编号不会被重新使用，新条目的编号总是大于已有的游标。
+    """
+
+    LEGACY_FEED = ""  # 从 rss_cache3.txt 迁移来的、不区分源的旧缓存
+
+    def __init__(self, path, max_per_feed, ttl_days):
+        self.max_per_feed = max_per_feed
+        self.ttl = ttl_days * 86400
+        self.last_compact = time.time()
+        self.present = {}  # feed -> 最近一次抓取中出现的条目编号，清理时保留
+        self.early_stops = {}  # feed -> 还允许提前停止读取的次数，只有确认新条目排在前面的源才允许
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, feed TEXT NOT NULL, guid TEXT NOT NULL, "
+            "matched INTEGER NOT NULL, seen_at REAL NOT NULL, UNIQUE (feed, guid))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cursors ("
+            "feed TEXT NOT NULL, chat_id TEXT NOT NULL, last_id INTEGER NOT NULL, "
+            "PRIMARY KEY (feed, chat_id)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.commit()
+
+        self.upgrade_entries_table()
+        self.migrate_legacy_cache(CACHE_FILE)
+
+        # 没有游标的订阅者使用默认游标：启用按订阅者去重之前的条目都视为已处理，避免升级后重复推送
+        self.db.execute(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "SELECT 'default_cursor', IFNULL(MAX(id), 0) FROM entries"
+        )
+        self.db.commit()
+        self.default_cursor = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'default_cursor'"
+        ).fetchone()[0]
+
+        self.load_index()
+
+    def load_index(self):
+        # feed -> {guid: id}，以及每个源的最大条目编号
+        self.index = {}
+        self.last_ids = {}
+        for entry_id, feed, guid in self.db.execute("SELECT id, feed, guid FROM entries ORDER BY id"):
+            self.index.setdefault(feed, {})[guid] = entry_id
+            self.last_ids[feed] = entry_id
+        self.legacy = self.index.get(self.LEGACY_FEED, {})
+
+        # feed -> {chat_id: last_id}
+        self.cursors = {}
+        for feed, chat_id, last_id in self.db.execute("SELECT feed, chat_id, last_id FROM cursors"):
+            self.cursors.setdefault(feed, {})[chat_id] = last_id
+
+    def upgrade_entries_table(self):
+        # 旧版 entries 表没有 AUTOINCREMENT，SQLite 会在清理后重新使用已删除的最大编号，
+        # 新条目可能落在游标之内而被当作已处理。重建为 AUTOINCREMENT 表，编号从已用过的最大值继续
+        sql = self.db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone()[0]
+        if "AUTOINCREMENT" in sql.upper():
+            return
+        high_water = self.db.execute(
+            "SELECT MAX(IFNULL((SELECT MAX(id) FROM entries), 0), "
+            "IFNULL((SELECT MAX(last_id) FROM cursors), 0), "
+            "IFNULL((SELECT value FROM meta WHERE key = 'default_cursor'), 0))"
+        ).fetchone()[0]
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute(
+                "CREATE TABLE entries_new ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, feed TEXT NOT NULL, guid TEXT NOT NULL, "
+                "matched INTEGER NOT NULL, seen_at REAL NOT NULL, UNIQUE (feed, guid))"
+            )
+            self.db.execute("INSERT INTO entries_new SELECT id, feed, guid, matched, seen_at FROM entries")
+            self.db.execute("DROP TABLE entries")
+            self.db.execute("ALTER TABLE entries_new RENAME TO entries")
+            self.db.execute("DELETE FROM sqlite_sequence WHERE name = 'entries'")
+            self.db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('entries', ?)", (high_water,))
+        print(f"Upgraded seen entries table, next entry id > {high_water}")
+
+    def migrate_legacy_cache(self, cache_file):
+        if not os.path.exists(cache_file):
+            return
+        with open(cache_file, "r") as f:
+            guids = [line.strip() for line in f if line.strip()]
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR IGNORE INTO entries (feed, guid, matched, seen_at) VALUES (?, ?, 1, ?)",
+            ((self.LEGACY_FEED, guid, now) for guid in guids),
+        )
+        self.db.commit()
+        os.replace(cache_file, cache_file + ".migrated")
+        print(f"Migrated {len(guids)} cached GUIDs from {cache_file}")
+
+    def entry_id(self, feed, guid):
+        """返回条目编号，从未处理过的条目返回 None"""
+        feed_index = self.index.get(feed)
+        entry_id = feed_index.get(guid) if feed_index is not None else None
+        if entry_id is None:
+            entry_id = self.legacy.get(guid)
+        return entry_id
+
+    def cursor(self, feed, chat_id):
+        return self.cursors.get(feed, {}).get(chat_id, self.default_cursor)
+
+    def add(self, feed, guid, matched):
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO entries (feed, guid, matched, seen_at) VALUES (?, ?, ?, ?)",
+            (feed, guid, int(matched), time.time()),
+        )
+        if not cursor.rowcount:
+            return self.index[feed][guid]
+        self.index.setdefault(feed, {})[guid] = cursor.lastrowid
+        self.last_ids[feed] = cursor.lastrowid
+        return cursor.lastrowid
+
+    def advance(self, feed, chat_ids):
+        """订阅者已处理完该源当前的全部条目，把游标推进到该源的最大条目编号"""
+        last_id = self.last_ids.get(feed)
+        if last_id is None:
+            return
+        feed_cursors = self.cursors.setdefault(feed, {})
+        updates = [
+            (feed, chat_id, last_id)
+            for chat_id in chat_ids
+            if feed_cursors.get(chat_id, self.default_cursor) < last_id
+        ]
+        if updates:
+            self.db.executemany("INSERT OR REPLACE INTO cursors (feed, chat_id, last_id) VALUES (?, ?, ?)", updates)
+            for _, chat_id, _ in updates:
+                feed_cursors[chat_id] = last_id
+
+    def mark_present(self, feed, entry_ids, partial=False):
+        if partial:
+            # 只读到了源的前一部分，未读到的旧条目按上次的结果继续保留，数量与上次相同
+            previous = self.present.get(feed, [])
+            keep = max(len(previous), len(entry_ids))
+            entry_ids = sorted(set(previous).union(entry_ids), reverse=True)[:keep]
+        self.present[feed] = entry_ids
+
+    # 记录一次读取的结果：完整读取时根据新条目是否都排在已知条目之前，决定之后能否提前停止
+    def record_order(self, feed, partial, newest_first):
+        if partial:
+            self.early_stops[feed] = self.early_stops.get(feed, 0) - 1
+        elif newest_first is not None:
+            self.early_stops[feed] = EARLY_STOP_RECHECK if newest_first else 0
+
+    # 返回判断条目是否已被该源所有订阅者处理过的函数，该源不允许提前停止时返回 None
+    def watermark(self, feed, subscribers):
+        if self.early_stops.get(feed, 0) <= 0:
+            return None
+        min_cursor = min(self.cursor(feed, chat_id) for chat_id, _ in subscribers)
+
+        def is_done(guid):
+            entry_id = self.entry_id(feed, guid)
+            return entry_id is not None and entry_id <= min_cursor
+
+        return is_done
+
+    def commit(self):
+        self.db.commit()
+
+    def maybe_compact(self):
+        if time.time() - self.last_compact >= SEEN_COMPACT_INTERVAL:
+            self.compact()
+
+    def compact(self):
+        """删除过期条目以及每个源超出数量上限的最旧条目，源中仍在出现的条目不删除"""
+        self.last_compact = time.time()
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS present (id INTEGER PRIMARY KEY)")
+        self.db.execute("DELETE FROM present")
+        self.db.executemany(
+            "INSERT OR IGNORE INTO present (id) VALUES (?)",
+            ((entry_id,) for entry_ids in self.present.values() for entry_id in entry_ids),
+        )
+
+        expired = self.db.execute(
+            "DELETE FROM entries WHERE seen_at < ? AND id NOT IN (SELECT id FROM present)",
+            (self.last_compact - self.ttl,),
+        ).rowcount
+        overflow = self.db.execute(
+            "DELETE FROM entries WHERE id IN ("
+            "SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY feed ORDER BY id DESC) AS rn "
+            "FROM entries WHERE feed != ?) WHERE rn > ?) AND id NOT IN (SELECT id FROM present)",
+            (self.LEGACY_FEED, self.max_per_feed),
+        ).rowcount
+        # 已没有任何条目的源（通常是已无人订阅）不再需要游标
+        self.db.execute("DELETE FROM cursors WHERE feed NOT IN (SELECT DISTINCT feed FROM entries)")
+        self.db.commit()
+        if expired or overflow:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.load_index()
+        print(f"Seen store compacted: {expired} expired, {overflow} over limit removed")
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+seen_store = None
+
+
+def get_seen_store():
+    global seen_store
+    if seen_store is None:
+        seen_store = SeenStore(SEEN_DB_FILE, SEEN_MAX_PER_FEED, SEEN_TTL_DAYS)
+    return seen_store
+
+
+class TokenBucket:
+    """令牌桶限速：rate 为每秒补充的令牌数，capacity 为允许的突发量"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # 先预占令牌（可为负数），再等待到令牌补足，多个等待者按先后顺序排队
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class DeliveryQueue:
+    """
+    推送队列：按聊天排队，由多个 worker 发送
+    全局与单个聊天分别用令牌桶限速，遇到 RetryAfter 按 Telegram 要求等待，其他临时错误指数退避重试
+    开启 DIGEST_MODE 时，同一聊天积压的多条推送合并为一条消息
+    """
+
+    def __init__(self, bot, outbox, workers, global_rate, chat_rate, max_retries, digest, digest_max_items):
+        self.bot = bot
+        self.outbox = outbox
+        self.global_bucket = TokenBucket(global_rate, capacity=max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+        self.max_retries = max_retries
+        self.digest = digest
+        self.digest_max_items = digest_max_items
+
+        self.pending = {}  # chat_id -> deque[发件箱记录]
+        self.queued_ids = set()  # 已在队列中或正在发送的发件箱记录编号
+        self.ready = asyncio.Queue()  # 有待发送消息的聊天，同一聊天同时只由一个 worker 处理
+        self.active = set()  # 已在 ready 中或正在发送的聊天
+        self.workers = [asyncio.ensure_future(self._worker()) for _ in range(workers)]
+
+        # 启动时补发发件箱中上次未确认的消息，无需重新抓取
+        self.requeue_pending()
+
+    def put(self, record):
+        chat_id = record["chat_id"]
+        self.queued_ids.add(record["id"])
+        self.pending.setdefault(chat_id, deque()).append(record)
+        if chat_id not in self.active:
+            self.active.add(chat_id)
+            self.ready.put_nowait(chat_id)
+
+    def requeue_pending(self):
+        for record in self.outbox.pending.values():
+            if record["id"] not in self.queued_ids:
+                self.put(record)
+
+    def backlog(self):
+        return sum(len(messages) for messages in self.pending.values())
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            try:
+                await self._send_next(chat_id)
+            except Exception as e:
+                print(f"Delivery worker error for {chat_id}: {e}")
+            finally:
+                # 发送一条后重新排到队尾，各聊天轮流发送
+                if self.pending.get(chat_id):
+                    self.ready.put_nowait(chat_id)
+                else:
+                    self.pending.pop(chat_id, None)
+                    self.active.discard(chat_id)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {
+                    key: value for key, value in self.chat_buckets.items() if not value.is_full()
+                }
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    def _next_batch(self, chat_id):
+        messages = self.pending[chat_id]
+        batch = [messages.popleft()]
+        if self.digest:
+            # 合并后的消息不超过 Telegram 单条 4096 字符的限制
+            length = len(batch[0]["text"])
+            while messages and len(batch) < self.digest_max_items:
+                length += len(messages[0]["text"]) + 2
+                if length > 4000:
+                    break
+                batch.append(messages.popleft())
+        return batch
+
+    async def _send_next(self, chat_id):
+        batch = self._next_batch(chat_id)
+        try:
+            await self._send_batch(chat_id, batch)
+        finally:
+            for record in batch:
+                self.queued_ids.discard(record["id"])
 
-def save_cache(cache):
-    with open(CACHE_FILE, "w") as f:
-        for guid in cache:
-            f.write(f"{guid}\n")
+    async def _send_batch(self, chat_id, batch):
+        text = "\n\n".join(record["text"] for record in batch)
 
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="MarkdownV2")
+            except RetryAfter as e:
+                print(f"Flood limit hit for {chat_id}, retrying after {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except (TimedOut, NetworkError) as e:
+                delay = min(60, 2 ** attempt)
+                print(f"Failed to send message to {chat_id}: {e}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                # 被拉黑、聊天不存在等无法通过重试恢复的错误，直接从发件箱移除
+                print(f"Failed to send message to {chat_id}: {e}")
+                self.outbox.ack(record["id"] for record in batch)
+                return
+            else:
+                for record in batch:
+                    print(f"Message sent to {chat_id}: {record['description']}")
+                self.outbox.ack(record["id"] for record in batch)
+                return
+
+        # 重试耗尽的消息留在发件箱中，下一轮检查时重新入队
+        print(f"Giving up sending message to {chat_id} after {self.max_retries} retries")
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        if self.backlog():
+            print(f"Delivery queue closed with {self.backlog()} unsent messages")
+
+
+class Outbox:
+    """
+    持久化发件箱：每条匹配结果 (聊天, 条目, 渲染好的消息) 先追加写入文件，发送成功后追加确认记录
+    重启时回放文件，未确认的消息重新入队，实现至少一次送达；同一 (聊天, 条目) 只会入箱一次
+    """
+
+    def __init__(self, path, dedup_size):
+        self.path = path
+        self.dedup_size = dedup_size
+        self.pending = {}  # id -> 未确认的记录
+        self.pending_keys = set()  # 未确认记录的 (chat_id, key)
+        self.done_keys = OrderedDict()  # 最近已完成的 (chat_id, key)，按完成先后排列
+        self.next_id = 1
+        self.lines = 0
+        self._replay()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.lines += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下写了一半的最后一行
+                    continue
+                if record["op"] == "add":
+                    self.pending[record["id"]] = record
+                    self.pending_keys.add((record["chat_id"], record["key"]))
+                    self.next_id = max(self.next_id, record["id"] + 1)
+                elif record["op"] == "ack":
+                    self._complete(record["id"])
+                elif record["op"] == "done":
+                    self._remember_done((record["chat_id"], record["key"]))
+        if self.pending:
+            print(f"Outbox: {len(self.pending)} unsent messages recovered")
+
+    def _remember_done(self, key):
+        self.done_keys[key] = None
+        self.done_keys.move_to_end(key)
+        while len(self.done_keys) > self.dedup_size:
+            self.done_keys.popitem(last=False)
+
+    def _complete(self, record_id):
+        record = self.pending.pop(record_id, None)
+        if record is not None:
+            key = (record["chat_id"], record["key"])
+            self.pending_keys.discard(key)
+            self._remember_done(key)
+
+    def _append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.lines += 1
+
+    def add(self, chat_id, key, text, description):
+        """写入一条待推送消息，(chat_id, key) 已入箱过则返回 None"""
+        if (chat_id, key) in self.pending_keys or (chat_id, key) in self.done_keys:
+            return None
+        record = {
+            "op": "add", "id": self.next_id, "chat_id": chat_id, "key": key,
+            "text": text, "description": description,
+        }
+        self.next_id += 1
+        self._append(record)
+        self.pending[record["id"]] = record
+        self.pending_keys.add((chat_id, key))
+        return record
+
+    def ack(self, record_ids):
+        for record_id in record_ids:
+            if record_id in self.pending:
+                self._append({"op": "ack", "id": record_id})
+                self._complete(record_id)
+        self.file.flush()
+
+    def sync(self):
+        """把已写入的记录刷到磁盘"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def maybe_compact(self):
+        # 文件中的记录远多于仍需保留的记录时重写文件
+        if self.lines > 2 * (len(self.pending) + len(self.done_keys)) + 1000:
+            self.compact()
+
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for chat_id, key in self.done_keys:
+                f.write(json.dumps({"op": "done", "chat_id": chat_id, "key": key}, ensure_ascii=False) + "\n")
+            for record in self.pending.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.lines = len(self.done_keys) + len(self.pending)
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+outbox = None
+
+
+def get_outbox():
+    global outbox
+    if outbox is None:
+        outbox = Outbox(OUTBOX_FILE, OUTBOX_DEDUP_SIZE)
+    return outbox
+
+
+delivery_queue = None
+
+
+def get_delivery_queue(bot):
+    global delivery_queue
+    if delivery_queue is None:
+        delivery_queue = DeliveryQueue(
+            bot, get_outbox(), SEND_WORKERS, SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_MAX_RETRIES, DIGEST_MODE, DIGEST_MAX_ITEMS
+        )
+    return delivery_queue
 
 
 # 添加用户到白名单
@@ -684,7 +2352,6 @@ async def add_user(update, context):
         return
 
     new_user_id = int(context.args[0])
-    allowed_users = load_allowed_users()
 
     if new_user_id in allowed_users:
         await update.message.reply_text(f"用户 ID {new_user_id} 已在白名单中。")
@@ -705,9 +2372,10 @@ async def toggle_whitelist(update, context):
         await update.message.reply_text("请提供有效参数：/whitelist on 或 /whitelist off")
         return
 
-    status = context.args[0].lower() == "on"
-    save_whitelist_status(status)
-    status_text = "开启" if status else "关闭"
+    global whitelist_enabled
+    whitelist_enabled = context.args[0].lower() == "on"
+    save_whitelist_status(whitelist_enabled)
+    status_text = "开启" if whitelist_enabled else "关闭"
     await update.message.reply_text(f"白名单模式已{status_text}。")
 
 # 处理 /help 命令
@@ -753,6 +2421,21 @@ async def help_command(update, context):
 
     await update.message.reply_text(help_text)
 
+# 退出时释放网络连接并落盘
+async def on_shutdown(application):
+    await close_http_client()
+    if parse_pool is not None:
+        parse_pool.shutdown(cancel_futures=True)
+    if delivery_queue is not None:
+        await delivery_queue.close()
+    if outbox is not None:
+        outbox.close()
+    if user_store is not None:
+        await user_store.flush()
+    if seen_store is not None:
+        seen_store.close()
+
+
 # 主函数
 def main():
     if not TELEGRAM_BOT_TOKEN:
@@ -765,7 +2448,13 @@ def main():
 
     # 创建应用时启用 JobQueue
     from telegram.ext import JobQueue
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).job_queue(JobQueue()).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .job_queue(JobQueue())
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("add_rss", add_rss))
@@ -779,10 +2468,19 @@ def main():
     application.add_handler(CommandHandler("group_verify", toggle_group_verify))
     application.add_handler(CommandHandler("help", help_command))
 
-    # 使用环境变量中的更新间隔
-    application.job_queue.run_repeating(check_new_posts, interval=UPDATE_INTERVAL, first=0)
+    # 启动时加载一次用户数据和白名单，之后常驻内存
+    get_user_store()
+    load_whitelist_state()
+    if WHITELIST_RELOAD_INTERVAL > 0:
+        application.job_queue.run_repeating(reload_whitelist_if_changed, interval=WHITELIST_RELOAD_INTERVAL)
+
+    # 定期检查到期的源，各源的抓取间隔在 FEED_MIN_INTERVAL 与 FEED_MAX_INTERVAL 之间自适应
+    application.job_queue.run_repeating(check_new_posts, interval=SCHEDULER_TICK, first=0)
 
-    print(f"Bot 启动成功，更新间隔：{UPDATE_INTERVAL} 秒")
+    print(
+        f"Bot 启动成功，基础更新间隔：{UPDATE_INTERVAL} 秒"
+        f"（自适应范围 {FEED_MIN_INTERVAL}-{FEED_MAX_INTERVAL} 秒）"
+    )
     application.run_polling()
     
 if __name__ == "__main__":